@@ -0,0 +1,137 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+import hmac
+import os
+import threading
+import time
+
+from flask import Blueprint, Response, abort, request
+
+from api.rate_limit import get_rate_limiter
+from api.signer import get_signer
+
+
+# Upper bounds in seconds, shared by every histogram so memory stays fixed
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+metrics_api = Blueprint('metrics_api', __name__)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram in the Prometheus style."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class Metrics:
+    """In-memory counters and histograms for the signed-URL service.
+
+    Label values are limited to validated function and project names, so
+    the number of series is bounded no matter what clients send.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stage_latency = {}
+        self.request_latency = {}
+        self.requests = Counter()
+        self.counters = Counter()
+
+    def observe_stage(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self.stage_latency.get(stage)
+            if histogram is None:
+                histogram = self.stage_latency[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def observe_request(self, endpoint: str, function: str, project: str, status: int, seconds: float):
+        with self._lock:
+            self.requests[(endpoint, function, project, status)] += 1
+            histogram = self.request_latency.get(endpoint)
+            if histogram is None:
+                histogram = self.request_latency[endpoint] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Time the enclosed block as one stage of request handling."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    def render(self, extra_counters: dict = None) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            lines.append("# TYPE signed_url_requests_total counter")
+            for (endpoint, function, project, status), count in sorted(self.requests.items()):
+                lines.append(
+                    f'signed_url_requests_total{{endpoint="{endpoint}",function="{function}",'
+                    f'project="{project}",status="{status}"}} {count}'
+                )
+
+            _render_histograms(lines, "signed_url_stage_seconds", "stage", self.stage_latency)
+            _render_histograms(lines, "signed_url_request_seconds", "endpoint", self.request_latency)
+
+            counters = dict(self.counters)
+
+        counters.update(extra_counters or {})
+        for name, value in sorted(counters.items()):
+            lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+def _render_histograms(lines, name, label, histograms):
+    lines.append(f"# TYPE {name} histogram")
+    for label_value, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label}="{label_value}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label}="{label_value}",le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{label}="{label_value}"}} {histogram.total:.6f}')
+        lines.append(f'{name}_count{{{label}="{label_value}"}} {histogram.count}')
+
+
+metrics = Metrics()
+
+
+def authorized():
+    """Check for the TRIO_METRICS_TOKEN bearer token, or a request from App Engine cron.
+
+    App Engine removes X-Appengine-Cron from requests that do not come
+    from its cron service.
+    """
+    if request.headers.get('X-Appengine-Cron') == 'true':
+        return True
+    token = os.environ.get('TRIO_METRICS_TOKEN')
+    header = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(header.encode('utf-8'), f"Bearer {token}".encode('utf-8'))
+
+
+@metrics_api.route('/metrics')
+def get_metrics():
+    # Traffic per project and function is not public
+    if not authorized():
+        abort(403, "Forbidden")
+    # Signer counters are prefixed so they read as a family in Prometheus
+    extra_counters = {f"signer_{name}_total": value for name, value in get_signer().stats().items()}
+    extra_counters.update({f"rate_limiter_{name}_total": value for name, value in get_rate_limiter().stats().items()})
+    return Response(metrics.render(extra_counters), mimetype='text/plain; version=0.0.4')
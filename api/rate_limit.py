@@ -0,0 +1,117 @@
+from collections import OrderedDict, namedtuple
+import json
+import os
+import threading
+import time
+
+
+# Sustained requests per minute and burst size for one device and function
+RateLimit = namedtuple('RateLimit', ['per_minute', 'burst'])
+
+DEFAULT_LIMIT = RateLimit(per_minute=6, burst=20)
+# determineBasal runs every loop, makeProfile rarely
+FUNCTION_LIMITS = {
+    "determineBasal": RateLimit(per_minute=30, burst=60),
+    "makeProfile": RateLimit(per_minute=2, burst=10),
+}
+# Buckets for the least recently seen devices are dropped beyond this
+MAX_TRACKED_KEYS = 10000
+
+
+class RateLimiter:
+    """Token buckets per device and function, in the memory of this instance.
+
+    Each bucket refills at its function's `per_minute` rate up to `burst`
+    tokens. With `by_app_version`, each app version of a device gets its own
+    buckets. Only MAX_TRACKED_KEYS buckets are kept, evicting the least
+    recently used, so memory stays bounded however many device IDs clients
+    send. An evicted device starts over with a full bucket.
+    """
+
+    def __init__(self, limits: dict = None, default: RateLimit = DEFAULT_LIMIT, max_keys: int = MAX_TRACKED_KEYS,
+                 by_app_version: bool = False, clock=time.monotonic):
+        self.limits = FUNCTION_LIMITS if limits is None else limits
+        self.default = default
+        self.max_keys = max_keys
+        self.by_app_version = by_app_version
+        self.clock = clock
+        self.allowed_count = 0
+        self.limited_count = 0
+        self.evicted_count = 0
+        self._lock = threading.Lock()
+        # key -> [tokens, last refill time]
+        self._buckets = OrderedDict()
+
+    def limit(self, function: str) -> RateLimit:
+        return self.limits.get(function, self.default)
+
+    def acquire(self, device_id: str, function: str, app_version: str = None) -> float:
+        """Take a token from the device's bucket for `function`.
+
+        Returns 0 if one was taken, otherwise the seconds until the bucket
+        holds one again.
+        """
+        limit = self.limit(function)
+        rate = limit.per_minute / 60
+        key = (device_id, app_version if self.by_app_version else None, function)
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(limit.burst), now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+                    self.evicted_count += 1
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(float(limit.burst), bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                self.allowed_count += 1
+                return 0
+            self.limited_count += 1
+            return (1 - bucket[0]) / rate
+
+    def stats(self) -> dict:
+        return {
+            'allowed_count': self.allowed_count,
+            'limited_count': self.limited_count,
+            'evicted_count': self.evicted_count,
+        }
+
+
+def limits_from_env(value: str) -> dict:
+    """Parse TRIO_RATE_LIMITS, e.g. '{"iob": [12, 30], "default": [6, 20]}'."""
+    limits = dict(FUNCTION_LIMITS)
+    for function, (per_minute, burst) in json.loads(value).items():
+        if per_minute <= 0 or burst < 1:
+            raise ValueError(f"Invalid rate limit for {function}: {per_minute} per minute, burst {burst}")
+        limits[function] = RateLimit(float(per_minute), int(burst))
+    return limits
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide rate limiter, creating it on first use."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                limits = limits_from_env(os.environ['TRIO_RATE_LIMITS']) if os.environ.get('TRIO_RATE_LIMITS') else dict(FUNCTION_LIMITS)
+                default = limits.pop('default', DEFAULT_LIMIT)
+                # TRIO_RATE_LIMIT_BY_VERSION=1 limits each app version of a device separately
+                by_app_version = os.environ.get('TRIO_RATE_LIMIT_BY_VERSION') == '1'
+                _rate_limiter = RateLimiter(limits, default, by_app_version=by_app_version)
+    return _rate_limiter
+
+
+def set_rate_limiter(rate_limiter):
+    """Replace the process-wide rate limiter, e.g. with different limits."""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        _rate_limiter = rate_limiter
@@ -1,64 +1,371 @@
 from datetime import datetime, timedelta
+import math
+import time
 import uuid
-from google.cloud import storage
-from flask import Blueprint, request, jsonify, abort
+from flask import Blueprint, request, jsonify, abort, g
 
+from api.metrics import metrics
+from api.rate_limit import get_rate_limiter
+from api.signer import get_signer
 
-BUCKET_NAME = "trio-oref-logs-gcs"
+
+VALID_FUNCTIONS = {"determineBasal", "autosens", "makeProfile", "meal", "iob"}
+VALID_PROJECTS = {"trio-oref-validation"}
+URL_LIFETIME = timedelta(minutes=15)
+MAX_BATCH_ITEMS = 20
+# Batches may be uploaded gzipped, they are stored with Content-Encoding: gzip
+# and a .json.gz name so downloaders can tell them apart
+VALID_CONTENT_ENCODINGS = {"gzip"}
+
+# Upload grants cover many batches, so they get a bounded, longer lifetime
+DEFAULT_GRANT_LIFETIME = timedelta(minutes=30)
+MAX_GRANT_LIFETIME = timedelta(hours=1)
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
 
 sign_url_api = Blueprint('sign_url_api', __name__)
 
+
+@sign_url_api.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    # Only validated values become metric labels, see record_request
+    g.metric_function = "none"
+    g.metric_project = "none"
+
+
+@sign_url_api.after_request
+def record_request(response):
+    metrics.observe_request(
+        request.endpoint,
+        g.metric_function,
+        g.metric_project,
+        response.status_code,
+        time.perf_counter() - g.request_start,
+    )
+    return response
+
+
+def validate_function(function):
+    """Return an error message for an invalid function name, or None."""
+    if not isinstance(function, str) or function not in VALID_FUNCTIONS:
+        return "Invalid function name"
+    return None
+
+
+def validate_project(project):
+    """Return an error message for an invalid project, or None."""
+    if not isinstance(project, str) or project not in VALID_PROJECTS:
+        return "Invalid project"
+    return None
+
+
+def validate_device(device_id, app_version):
+    """Return an error message unless deviceId and appVersion are strings, or None."""
+    if not isinstance(device_id, str) or not isinstance(app_version, str):
+        return "Invalid deviceId or appVersion"
+    return None
+
+
+def validate_created_at(created_at):
+    """Return an error message for a createdAt that is not a usable timestamp, or None."""
+    if not isinstance(created_at, (int, float)):
+        return "Invalid createdAt"
+    try:
+        datetime.utcfromtimestamp(created_at)
+    except (OverflowError, OSError, ValueError):
+        return "Invalid createdAt"
+    return None
+
+
+def validate_content_encoding(content_encoding):
+    """Return an error message for an unsupported contentEncoding, or None."""
+    if content_encoding is not None and content_encoding not in VALID_CONTENT_ENCODINGS:
+        return "Invalid contentEncoding"
+    return None
+
+
+def admit(device_id, function, app_version):
+    """Abort with 429 if the device is over its rate limit for `function`."""
+    retry_after = get_rate_limiter().acquire(device_id, function, app_version)
+    if retry_after:
+        abort(429, "Rate limit exceeded", retry_after=math.ceil(retry_after))
+
+
+def object_prefix(project, created_at, app_version, function, device_id):
+    """Build the GCS prefix that holds one device's batches for a function and day."""
+    # Convert timestamp to UTC date for path
+    date = datetime.utcfromtimestamp(created_at).strftime("%Y-%m-%d")
+
+    # Construct GCS path with project as a component
+    return f"{project}/algorithm-comparisons/{date}/{app_version}/{function}/{device_id}/"
+
+
+def object_path(project, created_at, app_version, function, device_id, content_encoding=None):
+    """Build a new GCS object path for one upload batch."""
+    # Generate batch ID
+    batch_id = str(uuid.uuid4())
+    extension = ".json.gz" if content_encoding == "gzip" else ".json"
+
+    return f"{object_prefix(project, created_at, app_version, function, device_id)}{batch_id}{extension}"
+
+
+def sign_upload_url(path, content_encoding=None):
+    """Sign a PUT URL for a JSON upload to `path`.
+
+    With a `content_encoding`, the upload must send a matching
+    Content-Encoding header, which GCS keeps as object metadata.
+    """
+    signer = get_signer()
+    with metrics.stage('client_acquire'):
+        signer.bucket()
+
+    with metrics.stage('sign'):
+        return signer.sign_url(
+            path,
+            expiration=URL_LIFETIME,
+            method="PUT",
+            content_type="application/json",
+            headers={"Content-Encoding": content_encoding} if content_encoding else None,
+        )
+
+
 @sign_url_api.route('/v1/signed-url', methods=['POST'])
 def get_signed_url():
     # Get request data
-    data = request.get_json()
+    with metrics.stage('parse'):
+        data = request.get_json()
     if not data:
         abort(400, "Missing request body")
-        
+
     # Extract required fields
     project = data.get('project')
     device_id = data.get('deviceId')
     app_version = data.get('appVersion')
     function = data.get('function')
     created_at = data.get('createdAt')
-    
-    # Validate required fields
-    if not all([project, device_id, app_version, function, created_at]):
-        abort(400, "Missing required fields")
-        
-    # Validate function name
-    valid_functions = {"determineBasal", "autosens", "makeProfile", "meal", "iob"}
-    if function not in valid_functions:
-        abort(400, "Invalid function name")
-
-    # Validate project
-    valid_projects = {"trio-oref-validation"}
-    if project not in valid_projects:
-        abort(400, "Invalid project")
-        
-    # Convert timestamp to UTC date for path
-    date = datetime.utcfromtimestamp(created_at).strftime("%Y-%m-%d")
-    
-    # Generate batch ID
-    batch_id = str(uuid.uuid4())
-    
-    # Construct GCS path with project as a component
-    path = f"{project}/algorithm-comparisons/{date}/{app_version}/{function}/{device_id}/{batch_id}.json"
-    
-    # Generate signed URL
-    client = storage.Client()
-    bucket = client.bucket(BUCKET_NAME)
-    blob = bucket.blob(path)
-    
-    expires_at = datetime.now() + timedelta(minutes=15)
-    url = blob.generate_signed_url(
-        version="v4",
-        expiration=timedelta(minutes=15),
-        method="PUT",
-        content_type="application/json",
-    )
-    
-    return jsonify({
-        "url": url,
-        "expiresAt": expires_at.timestamp()
-    })
+    content_encoding = data.get('contentEncoding')
+
+    with metrics.stage('validate'):
+        # Validate required fields
+        if not all([project, device_id, app_version, function, created_at]):
+            abort(400, "Missing required fields")
+
+        error = validate_device(device_id, app_version)
+        if error:
+            abort(400, error)
+
+        error = validate_created_at(created_at)
+        if error:
+            abort(400, error)
+
+        error = validate_content_encoding(content_encoding)
+        if error:
+            abort(400, error)
+
+        # Validate function name
+        error = validate_function(function)
+        if error:
+            abort(400, error)
+        g.metric_function = function
+
+        # Validate project
+        error = validate_project(project)
+        if error:
+            abort(400, error)
+        g.metric_project = project
+
+        admit(device_id, function, app_version)
+
+    path = object_path(project, created_at, app_version, function, device_id, content_encoding)
+
+    # Generate signed URL with the process-wide client and credentials
+    expires_at = datetime.now() + URL_LIFETIME
+    url = sign_upload_url(path, content_encoding)
+
+    with metrics.stage('serialize'):
+        response = {
+            "url": url,
+            "expiresAt": expires_at.timestamp()
+        }
+        if content_encoding:
+            response["contentEncoding"] = content_encoding
+        return jsonify(response)
+
+
+@sign_url_api.route('/v1/signed-urls', methods=['POST'])
+def get_signed_urls():
+    """Sign upload URLs for several (function, createdAt) items in one request."""
+    with metrics.stage('parse'):
+        data = request.get_json()
+    if not data:
+        abort(400, "Missing request body")
+
+    # Fields shared by every item
+    project = data.get('project')
+    device_id = data.get('deviceId')
+    app_version = data.get('appVersion')
+    items = data.get('items')
+    content_encoding = data.get('contentEncoding')
+
+    # Batch requests mix functions, so they get their own label
+    g.metric_function = "batch"
+
+    with metrics.stage('validate'):
+        if not all([project, device_id, app_version]) or not isinstance(items, list) or not items:
+            abort(400, "Missing required fields")
+
+        if len(items) > MAX_BATCH_ITEMS:
+            abort(400, f"Too many items, at most {MAX_BATCH_ITEMS} per request")
+
+        error = validate_device(device_id, app_version)
+        if error:
+            abort(400, error)
+
+        error = validate_content_encoding(content_encoding)
+        if error:
+            abort(400, error)
+
+        error = validate_project(project)
+        if error:
+            abort(400, error)
+        g.metric_project = project
+
+        # Validate every item before signing anything, per-item problems are
+        # reported in place so the rest of the batch still gets URLs
+        results = []
+        for item in items:
+            if not isinstance(item, dict):
+                results.append({"error": "Malformed item"})
+                continue
+
+            function = item.get('function')
+            created_at = item.get('createdAt')
+            result = {"function": function, "createdAt": created_at}
+            if not all([function, created_at]):
+                result["error"] = "Missing required fields"
+            elif validate_created_at(created_at):
+                result["error"] = validate_created_at(created_at)
+            else:
+                error = validate_function(function)
+                if error:
+                    result["error"] = error
+                else:
+                    retry_after = get_rate_limiter().acquire(device_id, function, app_version)
+                    if retry_after:
+                        result["error"] = "Rate limit exceeded"
+                        result["retryAfter"] = math.ceil(retry_after)
+            results.append(result)
+
+        # Only a batch with nothing to sign but rate limited items is refused
+        limited = [result["retryAfter"] for result in results if "retryAfter" in result]
+        if limited and all("error" in result for result in results):
+            abort(429, "Rate limit exceeded", retry_after=min(limited))
+
+    expires_at = datetime.now() + URL_LIFETIME
+    for result in results:
+        if "error" in result:
+            continue
+        path = object_path(project, result["createdAt"], app_version, result["function"], device_id, content_encoding)
+        result["url"] = sign_upload_url(path, content_encoding)
+
+    with metrics.stage('serialize'):
+        response = {
+            "urls": results,
+            "expiresAt": expires_at.timestamp()
+        }
+        if content_encoding:
+            response["contentEncoding"] = content_encoding
+        return jsonify(response)
+
+
+@sign_url_api.route('/v1/upload-grant', methods=['POST'])
+def get_upload_grant():
+    """Sign a POST policy that lets a device upload many batches under one prefix.
+
+    The device uploads each batch as a multipart form POST to `url` with the
+    returned `fields` and a file part named `{batch_id}.json`, GCS
+    substitutes the file name into `key`. Gzip grants expect
+    `{batch_id}.json.gz` and gzipped file parts. POST policies cannot match
+    a key suffix, so the downloader skips blobs with the wrong one. It also
+    skips file names with a `/`, which the prefix condition cannot prevent.
+    """
+    with metrics.stage('parse'):
+        data = request.get_json()
+    if not data:
+        abort(400, "Missing request body")
+
+    project = data.get('project')
+    device_id = data.get('deviceId')
+    app_version = data.get('appVersion')
+    function = data.get('function')
+    created_at = data.get('createdAt')
+    lifetime_minutes = data.get('lifetimeMinutes')
+    content_encoding = data.get('contentEncoding')
+
+    with metrics.stage('validate'):
+        if not all([project, device_id, app_version, function, created_at]):
+            abort(400, "Missing required fields")
+
+        error = validate_device(device_id, app_version)
+        if error:
+            abort(400, error)
+
+        error = validate_created_at(created_at)
+        if error:
+            abort(400, error)
+
+        error = validate_content_encoding(content_encoding)
+        if error:
+            abort(400, error)
+
+        error = validate_function(function)
+        if error:
+            abort(400, error)
+        g.metric_function = function
+
+        error = validate_project(project)
+        if error:
+            abort(400, error)
+        g.metric_project = project
+
+        # Clamp the requested lifetime so a grant never outlives MAX_GRANT_LIFETIME
+        lifetime = DEFAULT_GRANT_LIFETIME
+        if lifetime_minutes is not None:
+            if not isinstance(lifetime_minutes, (int, float)) or lifetime_minutes <= 0:
+                abort(400, "Invalid lifetimeMinutes")
+            lifetime = min(timedelta(minutes=lifetime_minutes), MAX_GRANT_LIFETIME)
+
+        admit(device_id, function, app_version)
+
+    prefix = object_prefix(project, created_at, app_version, function, device_id)
+
+    signer = get_signer()
+    with metrics.stage('client_acquire'):
+        signer.bucket()
+
+    fields = {"Content-Type": "application/json"}
+    conditions = [["content-length-range", 1, MAX_UPLOAD_BYTES]]
+    if content_encoding:
+        fields["Content-Encoding"] = content_encoding
+
+    expires_at = datetime.now() + lifetime
+    with metrics.stage('sign'):
+        policy = signer.sign_post_policy(
+            prefix + "${filename}",
+            expiration=lifetime,
+            conditions=conditions,
+            fields=fields,
+            key_prefix=prefix,
+        )
+
+    with metrics.stage('serialize'):
+        response = {
+            "url": policy["url"],
+            "fields": policy["fields"],
+            "prefix": prefix,
+            "maxBytes": MAX_UPLOAD_BYTES,
+            "expiresAt": expires_at.timestamp()
+        }
+        if content_encoding:
+            response["contentEncoding"] = content_encoding
+        return jsonify(response)
@@ -0,0 +1,286 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+BUCKET_NAME = "trio-oref-logs-gcs"
+
+# Refresh the access token this long before it expires
+REFRESH_MARGIN = timedelta(minutes=5)
+REFRESH_INTERVAL_SECONDS = 60
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+
+logger = logging.getLogger(__name__)
+
+
+class LocalSigner:
+    """Offline stand-in for GcsSigner, for local runs and benchmarks.
+
+    URLs and policies have the same shape as the real ones but are signed
+    with an HMAC over a local secret, so nothing talks to Google.
+    """
+
+    def __init__(self, bucket_name: str = BUCKET_NAME, secret: bytes = b"local-signer"):
+        self.bucket_name = bucket_name
+        self.secret = secret
+        self.local_sign_count = 0
+        self.remote_sign_count = 0
+        self._lock = threading.Lock()
+
+    def bucket(self):
+        return None
+
+    def warm(self):
+        pass
+
+    def _signature(self, message: str) -> str:
+        with self._lock:
+            self.local_sign_count += 1
+        return hmac.new(self.secret, message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def sign_url(self, path: str, expiration: timedelta, method: str = "PUT", content_type: str = None, headers: dict = None) -> str:
+        expires = int(expiration.total_seconds())
+        signature = self._signature(f"{method}\n{content_type}\n{sorted((headers or {}).items())}\n{path}\n{expires}")
+        return f"http://localhost/{self.bucket_name}/{path}?X-Goog-Expires={expires}&X-Goog-Signature={signature}"
+
+    def sign_post_policy(self, key: str, expiration: timedelta, conditions: list = None, fields: dict = None,
+                         key_prefix: str = None) -> dict:
+        expires_at = datetime.utcnow() + expiration
+        conditions = list(conditions or []) + [{key: value} for key, value in sorted((fields or {}).items())]
+        conditions += [{"bucket": self.bucket_name}, ["starts-with", "$key", key_prefix] if key_prefix is not None else {"key": key}]
+        policy = base64.b64encode(json.dumps(
+            {"conditions": conditions, "expiration": expires_at.isoformat() + "Z"},
+            sort_keys=True,
+            separators=(",", ":"),
+        ).encode('utf-8')).decode('utf-8')
+
+        policy_fields = dict(fields or {})
+        policy_fields.update({
+            "key": key,
+            "policy": policy,
+            "x-goog-signature": self._signature(policy),
+        })
+        return {"url": f"http://localhost/{self.bucket_name}/", "fields": policy_fields}
+
+    def stats(self) -> dict:
+        return {
+            'local_sign_count': self.local_sign_count,
+            'remote_sign_count': self.remote_sign_count,
+        }
+
+
+class GcsSigner:
+    """Signs GCS URLs with credentials and a bucket handle shared by the process.
+
+    The service account key is loaded and parsed once, and V4 URLs are signed
+    locally with its private key. If only token-based credentials are
+    available (App Engine default credentials), or local signing fails, we
+    fall back to the remote IAM signBlob call and count it in
+    `remote_sign_count`.
+    """
+
+    def __init__(self, bucket_name: str = BUCKET_NAME, key_file: str = None):
+        self.bucket_name = bucket_name
+        self.key_file = key_file or os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
+        self.local_sign_count = 0
+        self.remote_sign_count = 0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._credentials = None
+        self._remote = None
+        self._can_sign_locally = False
+        self._bucket = None
+        self._refresh_thread = None
+
+    def _load(self):
+        """Load credentials and build the client and bucket handle."""
+        # Imported here, they take longer than the rest of the app to import
+        start = time.perf_counter()
+        import google.auth
+        from google.auth.credentials import Signing
+        from google.cloud import storage
+        from google.oauth2 import service_account
+        imported = time.perf_counter()
+
+        if self.key_file and os.path.exists(self.key_file):
+            credentials = service_account.Credentials.from_service_account_file(self.key_file, scopes=SCOPES)
+            project = credentials.project_id
+        else:
+            credentials, project = google.auth.default(scopes=SCOPES)
+
+        client = storage.Client(project=project, credentials=credentials)
+        self._credentials = credentials
+        self._can_sign_locally = isinstance(credentials, Signing)
+        # Assigned last, the fast path in bucket() only checks this
+        self._bucket = client.bucket(self.bucket_name)
+
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name='gcs-signer-refresh', daemon=True)
+        self._refresh_thread.start()
+        logger.info(f"Loaded signing credentials (local signing: {self._can_sign_locally}) in "
+                    f"{(time.perf_counter() - start) * 1000:.0f} ms, {(imported - start) * 1000:.0f} ms of it importing")
+
+    def bucket(self):
+        """Return the cached bucket handle, loading credentials on first use."""
+        if self._bucket is None:
+            with self._lock:
+                if self._bucket is None:
+                    self._load()
+        return self._bucket
+
+    def warm(self):
+        """Do the one-off work of the first signing request ahead of it.
+
+        Loads credentials and the client, then either exercises the private
+        key or, for token-only credentials, fetches a token and builds the
+        IAM signer.
+        """
+        self.bucket()
+        if self._can_sign_locally:
+            self._credentials.sign_bytes(b"warmup")
+        else:
+            self._remote_credentials()
+
+    def _refresh_credentials(self):
+        """Refresh the access token if it is missing or about to expire."""
+        from google.auth.transport.requests import Request
+
+        credentials = self._credentials
+        expiry = credentials.expiry
+        if credentials.token is None or expiry is None or expiry - datetime.utcnow() < REFRESH_MARGIN:
+            with self._refresh_lock:
+                credentials.refresh(Request())
+        return credentials
+
+    def _refresh_loop(self):
+        """Keep the access token fresh so the remote path never blocks on it."""
+        while True:
+            time.sleep(REFRESH_INTERVAL_SECONDS)
+            try:
+                self._refresh_credentials()
+            except Exception as e:
+                logger.warning(f"Background credential refresh failed: {e}")
+
+    def _remote_credentials(self):
+        """Credentials that sign through the IAM signBlob API."""
+        if self._remote is None:
+            from google.auth import iam
+            from google.auth.transport.requests import Request
+            from google.oauth2 import service_account
+
+            credentials = self._refresh_credentials()
+            email = credentials.service_account_email
+            self._remote = service_account.Credentials(iam.Signer(Request(), credentials, email), email, TOKEN_URI)
+        return self._remote
+
+    def _count(self, attribute):
+        with self._lock:
+            setattr(self, attribute, getattr(self, attribute) + 1)
+
+    def _sign(self, sign):
+        """Call `sign(credentials)` locally if we can, remotely otherwise."""
+        if self._can_sign_locally:
+            try:
+                result = sign(self._credentials)
+                self._count('local_sign_count')
+                return result
+            except Exception:
+                logger.exception("Local signing failed, falling back to remote signBlob")
+
+        result = sign(self._remote_credentials())
+        self._count('remote_sign_count')
+        return result
+
+    def sign_url(self, path: str, expiration: timedelta, method: str = "PUT", content_type: str = None, headers: dict = None) -> str:
+        """Return a V4 signed URL for the object at `path`."""
+        blob = self.bucket().blob(path)
+        return self._sign(lambda credentials: blob.generate_signed_url(
+            version="v4",
+            expiration=expiration,
+            method=method,
+            content_type=content_type,
+            headers=headers,
+            credentials=credentials,
+        ))
+
+    def sign_post_policy(self, key: str, expiration: timedelta, conditions: list = None, fields: dict = None,
+                         key_prefix: str = None) -> dict:
+        """Return the URL and form fields of a V4 signed POST policy for `key`.
+
+        With `key_prefix`, the policy allows any key starting with it
+        instead of exactly `key`, so `key` may use `${filename}`. The client
+        library's generate_signed_post_policy_v4 always requires the exact
+        key, so the policy is built here the same way otherwise.
+        """
+        self.bucket()
+        return self._sign(lambda credentials: self._post_policy(credentials, key, expiration, conditions, fields, key_prefix))
+
+    def _post_policy(self, credentials, key, expiration, conditions, fields, key_prefix):
+        now = datetime.utcnow()
+        timestamp = now.strftime("%Y%m%dT%H%M%SZ")
+        credential = f"{credentials.signer_email}/{now.strftime('%Y%m%d')}/auto/storage/goog4_request"
+
+        conditions = list(conditions or []) + [{name: value} for name, value in sorted((fields or {}).items())]
+        conditions += [
+            {"bucket": self.bucket_name},
+            ["starts-with", "$key", key_prefix] if key_prefix is not None else {"key": key},
+            {"x-goog-date": timestamp},
+            {"x-goog-credential": credential},
+            {"x-goog-algorithm": "GOOG4-RSA-SHA256"},
+        ]
+        policy = base64.b64encode(json.dumps(
+            {"conditions": conditions, "expiration": (now + expiration).isoformat(timespec='seconds') + "Z"},
+            sort_keys=True,
+            separators=(",", ":"),
+        ).encode('utf-8'))
+        signature = binascii.hexlify(credentials.sign_bytes(policy)).decode('utf-8')
+
+        policy_fields = dict(fields or {})
+        policy_fields.update({
+            "key": key,
+            "x-goog-algorithm": "GOOG4-RSA-SHA256",
+            "x-goog-credential": credential,
+            "x-goog-date": timestamp,
+            "x-goog-signature": signature,
+            "policy": policy.decode('utf-8'),
+        })
+        return {"url": f"https://storage.googleapis.com/{self.bucket_name}/", "fields": policy_fields}
+
+    def stats(self) -> dict:
+        return {
+            'local_sign_count': self.local_sign_count,
+            'remote_sign_count': self.remote_sign_count,
+        }
+
+
+_signer = None
+_signer_lock = threading.Lock()
+
+
+def get_signer():
+    """Return the process-wide signer, creating it on first use."""
+    global _signer
+    if _signer is None:
+        with _signer_lock:
+            if _signer is None:
+                # TRIO_SIGNER=local runs the service without Google credentials
+                if os.environ.get('TRIO_SIGNER') == 'local':
+                    _signer = LocalSigner()
+                else:
+                    _signer = GcsSigner()
+    return _signer
+
+
+def set_signer(signer):
+    """Replace the process-wide signer, e.g. with a local stand-in."""
+    global _signer
+    with _signer_lock:
+        _signer = signer
@@ -9,10 +9,16 @@ fi
 function=$1
 input_date=$2
 
-files=(downloaded_files/trio-oref-validation/algorithm-comparisons/${input_date}/0.5.1/${function}/*/*.json)
+# extract_day_errors.py reads loose and packed batches alike, but replaces
+# its output directory, so extract into a scratch one and add to errors/
+tmp_dir=$(mktemp -d)
+trap 'rm -rf "$tmp_dir"' EXIT
 
-if [ -e "${files[0]}" ]; then
-    for iob_json in "${files[@]}"; do
-        python scripts/extract_error_results.py "$iob_json"
-    done
-fi
+python scripts/extract_day_errors.py "$input_date" --function "$function" --version 0.5.1 --output-dir "$tmp_dir/extracted" > /dev/null || exit 1
+
+# One subdirectory per function, so serve_errors.py can filter on it
+shopt -s nullglob
+mkdir -p "errors/$function"
+for error_json in "$tmp_dir/extracted/$function"/*.json; do
+    mv "$error_json" "errors/$function/"
+done
@@ -1,16 +1,44 @@
+import time
+_import_start = time.perf_counter()
+
 from flask import Flask
 
 import logging
 import os
 import sys
 
+from api.metrics import metrics, metrics_api
 from api.sign_url import sign_url_api
+from api.signer import get_signer
+
 
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'google-auth.json'
 
 app.register_blueprint(sign_url_api)
+app.register_blueprint(metrics_api)
+
+
+def warm_signer():
+    """Load credentials and the GCS client before a device request needs them."""
+    start = time.perf_counter()
+    get_signer().warm()
+    elapsed = time.perf_counter() - start
+    metrics.observe_stage('warmup', elapsed)
+    logger.info(f"Warmed up signer in {elapsed * 1000:.0f} ms")
+
+
+@app.route('/_ah/warmup')
+def warmup():
+    # App Engine sends this before routing traffic to a new instance
+    warm_signer()
+    return '', 200
+
+
+logger.info(f"Imported app in {(time.perf_counter() - _import_start) * 1000:.0f} ms")
 
 
 if __name__ == '__main__':
@@ -19,5 +47,5 @@ if __name__ == '__main__':
         ip = sys.argv[1]
     else:
         ip = '127.0.0.1'
-        
+
     app.run(host=ip, port=5001, debug=True)
@@ -1,11 +1,14 @@
 import sys
 import subprocess
 import os
-import glob
 import atexit
 import shutil
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scripts'))
+from comparison_files import FUNCTIONS, date_range
+from extract_day_errors import extract_day_errors
+
 
 def check_trio_dev_repo():
     """
@@ -80,27 +83,6 @@ def get_simulator_id():
         return None
 
 
-def extract_timezones_from_errors():
-    """
-    Scans the 'errors' directory for JSON files and extracts the 'timezone'
-    field from each file.
-
-    Returns:
-        A set of unique timezone strings.
-    """
-    timezones = set()
-    error_files = glob.glob(os.path.join('errors', '*.json'))
-    for error_file in error_files:
-        with open(error_file, 'r') as f:
-            try:
-                data = json.load(f)
-                if 'timezone' in data:
-                    timezones.add(data['timezone'])
-            except json.JSONDecodeError:
-                print(f"Warning: Could not decode JSON from {error_file}")
-    return timezones
-
-
 def run_xcode_test(func, simulator_id):
     if not simulator_id:
         print("Skipping Xcode test due to missing simulator ID.")
@@ -142,12 +124,15 @@ def main():
     """
     This script performs the same actions as the run_tests_on_errors.sh script.
     It checks for a date argument, starts serve_errors.py in the background,
-    cleans the errors/ directory, and then runs extract_errors.sh.
+    extracts the day's errors for every function in one pass and then serves
+    each function's errors from the errors/ directory in turn.
     The serve_errors.py process is terminated automatically on script exit.
     """
-    # Check if an argument was provided
-    if len(sys.argv) != 2:
-        print("Usage: python run_tests_on_errors.py YYYY-MM-DD")
+    # Check if an argument was provided, --unique replays each distinct case once
+    args = [arg for arg in sys.argv[1:] if arg != '--unique']
+    unique = len(args) != len(sys.argv) - 1
+    if len(args) != 1:
+        print("Usage: python run_tests_on_errors.py YYYY-MM-DD [--unique]")
         print("Example: python run_tests_on_errors.py 2025-03-15")
         sys.exit(1)
 
@@ -155,7 +140,12 @@ def main():
     simulator_id = get_simulator_id()
 
     # Store the command line argument
-    input_date = sys.argv[1]
+    input_date = args[0]
+    try:
+        date_range(input_date)
+    except ValueError:
+        print(f"Invalid date: {input_date}, expected YYYY-MM-DD")
+        sys.exit(1)
 
     # Start serve_errors.py in the background
     # Use preexec_fn=os.setsid to create a new process group.
@@ -182,24 +172,20 @@ def main():
     # Initialize a dictionary to store the results
     results = {}
 
-    # Run extract_errors.sh on each function then run the tests if there are any
-    for func in ['autosens', 'determineBasal', 'iob', 'profile', 'meal']:
+    # Extract the errors of every function at once, then run the tests if there are any
+    manifest = extract_day_errors(input_date, unique=unique)
+
+    for func in FUNCTIONS:
         print(f"Checking {func}")
-        # Clean the errors directory
-        errors_dir = 'errors'
-        if os.path.exists(errors_dir):
-            shutil.rmtree(errors_dir)
-        os.makedirs(errors_dir)
-        
-        try:
-            subprocess.run(['./extract_errors.sh', func, input_date], check=True)
-        except subprocess.CalledProcessError as e:
-            print(f"extract_errors.sh failed with exit code {e.returncode}")
-            sys.exit(1)
+        # Serve this function's errors from errors/{func}, so /list?function= matches them
+        if os.path.exists('errors'):
+            shutil.rmtree('errors')
+        errors_dir = os.path.join('errors', func)
+        shutil.copytree(os.path.join('extracted_errors', func), errors_dir)
 
-        # Check for files in the errors directory
+        function_manifest = manifest['functions'][func]
         error_files = os.listdir(errors_dir)
-        results[func] = {'errors': len(error_files), 'xcode_pass': None}
+        results[func] = {'errors': function_manifest['errors'], 'cases': function_manifest['cases'], 'xcode_pass': None}
         if not error_files:
             print("  - No errors found in the 'errors' directory.")
         else:
@@ -209,7 +195,7 @@ def main():
                     print("  - No simulator found. Skipping tests.")
                     continue
 
-                timezones = extract_timezones_from_errors()
+                timezones = function_manifest['timezones']
                 if not timezones:
                     print("  - No timezones found in error files. Skipping Xcode tests.")
                     results[func]['xcode_pass'] = None
@@ -249,7 +235,7 @@ def main():
         elif result['xcode_pass'] is False:
             xcode_status = "❌"
         
-        print(f"- {func}: {error_count} errors, Xcode tests: {xcode_status}")
+        print(f"- {func}: {error_count} errors ({result['cases']} distinct), Xcode tests: {xcode_status}")
 
 
 if __name__ == "__main__":
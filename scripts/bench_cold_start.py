@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""Cold-start measurement for the signed-URL service.
+
+Each run starts main.py in a fresh process and measures how long until it
+accepts connections, how long the first and second signing requests take
+and, with warmup, how long /_ah/warmup takes. The GCS signer runs for real
+against a throwaway service account key generated for the run. Client
+setup and signing are local, so nothing talks to Google. `import` mode
+reports the import time of main.py from `python -X importtime` instead.
+
+Example:
+    python scripts/bench_cold_start.py --runs 5
+    python scripts/bench_cold_start.py --mode import --runs 10 --json cold.json
+"""
+
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_serve_errors import free_port
+from bench_signed_url import git_revision
+
+REPO_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+# Serves main.app like a single App Engine worker would
+SERVER = ("import sys; from werkzeug.serving import make_server; from main import app; "
+          "make_server('127.0.0.1', int(sys.argv[1]), app, threaded=True).serve_forever()")
+STARTUPS = ['lazy', 'warmup']
+PAYLOAD = json.dumps({
+    "project": "trio-oref-validation",
+    "deviceId": "BENCH-0001",
+    "appVersion": "0.5.1",
+    "function": "iob",
+    "createdAt": 1750000000,
+})
+
+
+def write_fake_key(directory):
+    """Write a service account key that works offline as google-auth.json."""
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    with open(os.path.join(directory, 'google-auth.json'), 'w') as f:
+        json.dump({
+            "type": "service_account",
+            "project_id": "bench-project",
+            "private_key_id": "bench",
+            "private_key": pem.decode('utf-8'),
+            "client_email": "bench@bench-project.iam.gserviceaccount.com",
+            "client_id": "0",
+            "token_uri": "https://oauth2.googleapis.com/token",
+        }, f)
+
+
+def server_env(signer):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    env.pop('TRIO_SIGNER', None)
+    if signer == 'local':
+        env['TRIO_SIGNER'] = 'local'
+    return env
+
+
+def timed_request(port, method, path, body=None):
+    """Return (status, seconds) for one request on a new connection."""
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    connection.request(method, path, body=body, headers={'Content-Type': 'application/json'} if body else {})
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+    return response.status, time.perf_counter() - start
+
+
+def cold_start(directory, signer, startup):
+    """Start one server process and time its first requests, in milliseconds."""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', SERVER, str(port)], cwd=directory, env=server_env(signer),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + 60
+        while True:
+            try:
+                http.client.HTTPConnection('127.0.0.1', port, timeout=1).connect()
+                break
+            except OSError:
+                if time.perf_counter() > deadline or process.poll() is not None:
+                    raise RuntimeError("main.py did not start")
+                time.sleep(0.005)
+        result = {'ready_ms': (time.perf_counter() - start) * 1000}
+
+        if startup == 'warmup':
+            status, seconds = timed_request(port, 'GET', '/_ah/warmup')
+            if status != 200:
+                raise RuntimeError(f"/_ah/warmup returned {status}")
+            result['warmup_ms'] = seconds * 1000
+        for name in ('first_ms', 'second_ms'):
+            status, seconds = timed_request(port, 'POST', '/v1/signed-url', PAYLOAD)
+            if status != 200:
+                raise RuntimeError(f"/v1/signed-url returned {status}")
+            result[name] = seconds * 1000
+        result['first_response_ms'] = (time.perf_counter() - start) * 1000 - result['second_ms']
+        return result
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def import_time(directory, signer):
+    """Return (main.py import ms, [(cumulative ms, module)] of its slowest imports)."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=directory,
+                            env=server_env(signer), capture_output=True, text=True, check=True)
+    # Modules are listed after everything they import, indented two spaces per level
+    subtree = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0 and name.strip() == 'main':
+            direct = [(ms, module) for ms, module, module_depth in subtree if module_depth == 1]
+            return int(cumulative) / 1000, sorted(direct, reverse=True)[:10]
+        if depth == 0:
+            subtree = []
+        else:
+            subtree.append((int(cumulative) / 1000, name.strip(), depth))
+    raise RuntimeError("main was not imported")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time and time to first response.")
+    parser.add_argument('--mode', choices=['start', 'import'], default='start', help="What to measure")
+    parser.add_argument('--startup', action='append', choices=STARTUPS,
+                        help="Startup to measure, may be repeated, default both: without and with /_ah/warmup first")
+    parser.add_argument('--signer', choices=['gcs', 'local'], default='gcs', help="GCS signer with a throwaway key, or the HMAC stand-in")
+    parser.add_argument('--runs', type=int, default=5, help="Fresh processes per startup, medians are reported")
+    parser.add_argument('--json', dest='json_path', help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        write_fake_key(directory)
+        if args.mode == 'import':
+            runs = [import_time(directory, args.signer) for _ in range(args.runs)]
+            results['import_ms'] = statistics.median(total for total, _ in runs)
+            print(f"\n--- import main, median of {args.runs} runs ---")
+            print(f"main: {results['import_ms']:.1f} ms")
+            print("slowest imports made by main (last run):")
+            for ms, name in runs[-1][1]:
+                print(f"  {ms:8.1f} ms  {name}")
+        else:
+            print(f"\n--- cold start with the {args.signer} signer, median of {args.runs} runs (ms) ---")
+            print(f"{'startup':<10}{'ready':>10}{'warmup':>10}{'first':>10}{'second':>10}{'to first':>10}")
+            for startup in args.startup or STARTUPS:
+                runs = [cold_start(directory, args.signer, startup) for _ in range(args.runs)]
+                row = results[startup] = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+                warmup = f"{row['warmup_ms']:>10.1f}" if 'warmup_ms' in row else f"{'-':>10}"
+                print(f"{startup:<10}{row['ready_ms']:>10.1f}{warmup}{row['first_ms']:>10.1f}{row['second_ms']:>10.1f}{row['first_response_ms']:>10.1f}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({'revision': git_revision(), 'mode': args.mode, 'signer': args.signer, 'runs': args.runs, 'results': results}, f, indent=4)
+        print(f"\nWrote {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""Load test for serve_errors.py with parallel keep-alive clients.
+
+Starts serve_errors.py in a subprocess on a local port (or uses --url),
+serving either --dir or a generated set of error files, and measures
+requests/sec and latency for /list, /files and /bulk.ndjson.
+
+Example:
+    python scripts/bench_serve_errors.py --mode files --requests 5000 --concurrency 16
+    python scripts/bench_serve_errors.py --mode files --debug
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from bench_signed_url import git_revision, print_table, summarize
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+MODES = ['list', 'files', 'bulk']
+TIMEZONES = ['America/Los_Angeles', 'Europe/Berlin', 'Asia/Tokyo']
+
+
+def generate_files(directory, count, seed):
+    """Write `count` synthetic iob error records to `directory`."""
+    rng = random.Random(seed)
+    for index in range(count):
+        record = {
+            "createdAt": 1750000000 + index,
+            "deviceId": f"BENCH-{rng.randrange(100):03d}",
+            "resultType": "valueDifference",
+            "timezone": rng.choice(TIMEZONES),
+            "iobInput": {"history": [{"amount": rng.random(), "timestamp": 1750000000 - i * 300} for i in range(50)]},
+        }
+        with open(os.path.join(directory, f"bench.{index}.json"), 'w') as f:
+            json.dump(record, f, indent=4, sort_keys=True)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_server(directory, server, threads, debug):
+    """Run serve_errors.py in a subprocess and wait until it answers."""
+    port = free_port()
+    command = [sys.executable, os.path.join(REPO_DIR, 'serve_errors.py'), '--host', '127.0.0.1', '--port', str(port),
+               '--dir', directory, '--threads', str(threads), '--server', server]
+    if debug:
+        command.append('--debug')
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("serve_errors.py did not start")
+
+
+def fetch(connection, path, gzip):
+    headers = {'Accept-Encoding': 'gzip'} if gzip else {}
+    connection.request('GET', path, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    return response.status, body, response.getheader('Connection', '').lower() == 'close'
+
+
+def run_benchmark(base_url, mode, requests, concurrency, gzip):
+    """Send `requests` requests over `concurrency` connections, return samples."""
+    target = urlsplit(base_url)
+    connection = http.client.HTTPConnection(target.hostname, target.port)
+    _, body, _ = fetch(connection, '/list', False)
+    connection.close()
+    files = json.loads(body)
+    if mode == 'files' and not files:
+        raise RuntimeError("No files to fetch")
+
+    if mode == 'list':
+        plan = ['/list?limit=100'] * requests
+    elif mode == 'bulk':
+        plan = ['/bulk.ndjson'] * requests
+    else:
+        plan = [files[i % len(files)] for i in range(requests)]
+
+    def worker(shard):
+        connection = http.client.HTTPConnection(target.hostname, target.port)
+        samples = []
+        for path in shard:
+            start = time.perf_counter()
+            try:
+                status, _, closed = fetch(connection, path, gzip)
+            except (http.client.HTTPException, OSError):
+                status, closed = 'error', True
+            samples.append((mode, status, time.perf_counter() - start))
+            if closed:
+                # The server does not keep connections alive (e.g. --debug)
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port)
+        connection.close()
+        return samples
+
+    shards = [plan[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = [sample for shard in executor.map(worker, shards) for sample in shard]
+    elapsed = time.perf_counter() - start
+    return samples, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark serve_errors.py under parallel clients.")
+    parser.add_argument('--mode', choices=MODES, default='files', help="Endpoint to drive")
+    parser.add_argument('--requests', type=int, default=2000, help="Total number of requests")
+    parser.add_argument('--concurrency', type=int, default=8, help="Number of concurrent keep-alive clients")
+    parser.add_argument('--files', type=int, default=500, help="Number of generated error files when --dir is not given")
+    parser.add_argument('--dir', help="Serve this directory instead of generated files")
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'werkzeug'], default='auto', help="Serving mode to start")
+    parser.add_argument('--threads', type=int, default=16, help="Server threads")
+    parser.add_argument('--debug', action='store_true', help="Benchmark the Flask debug server instead")
+    parser.add_argument('--gzip', action='store_true', help="Send Accept-Encoding: gzip")
+    parser.add_argument('--url', help="Benchmark an already running server instead of starting one")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    process = None
+    base_url = args.url
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not base_url:
+            directory = args.dir
+            if directory is None:
+                directory = tmp_dir
+                generate_files(directory, args.files, args.seed)
+            process, base_url = start_server(directory, args.server, args.threads, args.debug)
+
+        try:
+            samples, elapsed = run_benchmark(base_url, args.mode, args.requests, args.concurrency, args.gzip)
+        finally:
+            if process:
+                process.terminate()
+                process.wait()
+
+    rows = summarize(samples, elapsed)
+    server = 'debug' if args.debug else args.server
+    print(f"\n--- {args.mode} on {server} server, {args.requests} requests, concurrency {args.concurrency} ---")
+    print_table(rows)
+
+    if args.json_path:
+        result = {
+            'revision': git_revision(),
+            'mode': args.mode,
+            'server': server,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'elapsed_seconds': elapsed,
+            'results': rows,
+        }
+        with open(args.json_path, 'w') as f:
+            json.dump(result, f, indent=4)
+        print(f"\nWrote {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
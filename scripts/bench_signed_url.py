@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""Load test for the signed-URL service with GCS replaced by a local signer.
+
+Starts the Flask app from main.py on a local port, drives it with a
+configurable number of concurrent keep-alive clients and a mix of payloads,
+and reports throughput and latency percentiles as a table and optionally
+as JSON for comparing commits.
+
+Example:
+    python scripts/bench_signed_url.py --requests 5000 --concurrency 16 \
+        --mix valid=8,missing=1,bad-function=1 --mode single --json bench.json
+"""
+
+import argparse
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+FUNCTIONS = ["determineBasal", "autosens", "makeProfile", "meal", "iob"]
+ENDPOINTS = {
+    'single': '/v1/signed-url',
+    'batch': '/v1/signed-urls',
+    'grant': '/v1/upload-grant',
+}
+
+
+def make_payload(kind, mode, rng):
+    """Build one request body of the given kind for the given endpoint mode."""
+    device_id = f"BENCH-{rng.randrange(1000):04d}"
+    created_at = time.time()
+    function = rng.choice(FUNCTIONS)
+    if kind == 'bad-function':
+        function = "notAFunction"
+
+    if mode == 'batch':
+        payload = {
+            "project": "trio-oref-validation",
+            "deviceId": device_id,
+            "appVersion": "0.5.1",
+            "items": [{"function": f, "createdAt": created_at} for f in FUNCTIONS],
+        }
+        if kind == 'bad-function':
+            payload["items"].append({"function": function, "createdAt": created_at})
+    else:
+        payload = {
+            "project": "trio-oref-validation",
+            "deviceId": device_id,
+            "appVersion": "0.5.1",
+            "function": function,
+            "createdAt": created_at,
+        }
+
+    if kind == 'missing':
+        del payload["deviceId"]
+    return payload
+
+
+def parse_mix(mix):
+    """Parse 'valid=8,missing=1' into a list of (kind, weight)."""
+    weights = []
+    for part in mix.split(','):
+        kind, _, weight = part.partition('=')
+        if kind not in ('valid', 'missing', 'bad-function'):
+            raise argparse.ArgumentTypeError(f"Unknown payload kind: {kind}")
+        weights.append((kind, float(weight or 1)))
+    return weights
+
+
+def start_local_server():
+    """Serve main.app on a free local port with the offline signer."""
+    os.environ['TRIO_SIGNER'] = 'local'
+    sys.path.insert(0, REPO_DIR)
+    from werkzeug.serving import make_server
+    from api.signer import LocalSigner, set_signer
+    from main import app
+
+    set_signer(LocalSigner())
+    # Per-request access logs would dominate the measurement
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_benchmark(base_url, mode, requests, concurrency, mix, seed):
+    """Send `requests` requests over `concurrency` connections, return samples."""
+    target = urlsplit(base_url)
+    path = ENDPOINTS[mode]
+    kinds = [kind for kind, _ in mix]
+    weights = [weight for _, weight in mix]
+
+    rng = random.Random(seed)
+    plan = [(kind, json.dumps(make_payload(kind, mode, rng))) for kind in rng.choices(kinds, weights, k=requests)]
+
+    def worker(shard):
+        connection = http.client.HTTPConnection(target.hostname, target.port)
+        samples = []
+        for kind, body in shard:
+            start = time.perf_counter()
+            connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            samples.append((kind, response.status, time.perf_counter() - start))
+        connection.close()
+        return samples
+
+    shards = [plan[i::concurrency] for i in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = [sample for shard in executor.map(worker, shards) for sample in shard]
+    elapsed = time.perf_counter() - start
+    return samples, elapsed
+
+
+def summarize(samples, elapsed):
+    """Group latency samples by payload kind, plus an 'all' row."""
+    groups = defaultdict(list)
+    statuses = defaultdict(Counter)
+    for kind, status, seconds in samples:
+        for group in (kind, 'all'):
+            groups[group].append(seconds)
+            statuses[group][status] += 1
+
+    rows = {}
+    for group, latencies in groups.items():
+        latencies.sort()
+        rows[group] = {
+            'requests': len(latencies),
+            'statuses': {str(status): count for status, count in sorted(statuses[group].items())},
+            'throughput_rps': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000,
+        }
+    return rows
+
+
+def print_table(rows):
+    print(f"{'payload':<14}{'requests':>10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses")
+    for group in sorted(rows, key=lambda g: (g == 'all', g)):
+        row = rows[group]
+        statuses = ' '.join(f"{status}:{count}" for status, count in row['statuses'].items())
+        print(f"{group:<14}{row['requests']:>10}{row['throughput_rps']:>10.1f}{row['p50_ms']:>10.2f}"
+              f"{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}{row['max_ms']:>10.2f}  {statuses}")
+
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the signed-URL endpoints with an offline signer.")
+    parser.add_argument('--mode', choices=sorted(ENDPOINTS), default='single', help="Endpoint to drive")
+    parser.add_argument('--requests', type=int, default=2000, help="Total number of requests")
+    parser.add_argument('--concurrency', type=int, default=8, help="Number of concurrent keep-alive clients")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix('valid=8,missing=1,bad-function=1'),
+                        help="Weighted payload mix, e.g. valid=8,missing=1,bad-function=1")
+    parser.add_argument('--url', help="Benchmark an already running server instead of starting one")
+    parser.add_argument('--warmup', type=int, default=50, help="Requests to send before measuring")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', dest='json_path', help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if not base_url:
+        server, base_url = start_local_server()
+
+    try:
+        if args.warmup:
+            run_benchmark(base_url, args.mode, args.warmup, 1, [('valid', 1)], args.seed)
+        samples, elapsed = run_benchmark(base_url, args.mode, args.requests, args.concurrency, args.mix, args.seed)
+    finally:
+        if server:
+            server.shutdown()
+
+    rows = summarize(samples, elapsed)
+    print(f"\n--- {args.mode} ({ENDPOINTS[args.mode]}), {args.requests} requests, concurrency {args.concurrency} ---")
+    print_table(rows)
+
+    if args.json_path:
+        result = {
+            'revision': git_revision(),
+            'mode': args.mode,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'mix': dict(args.mix),
+            'elapsed_seconds': elapsed,
+            'results': rows,
+        }
+        with open(args.json_path, 'w') as f:
+            json.dump(result, f, indent=4)
+        print(f"\nWrote {args.json_path}")
+
+
+if __name__ == "__main__":
+    main()
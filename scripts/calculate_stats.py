@@ -1,14 +1,34 @@
 #!/usr/bin/env python
 
+import argparse
+import contextlib
 import datetime
+import functools
+import hashlib
+import inspect
+import io
 import json
+import multiprocessing
 import os
 from collections import Counter, defaultdict
 
+from comparison_files import BATCH_SUFFIXES, iter_packed_batches
+from packed_archive import iter_packed_records
+from records import iter_records
+from stats_cache import StatsCache
+import timing_columns
+from timing_columns import TimingColumns, analyze, print_analysis
+from timing_summary import DurationSummary
+
 # Configuration
 # Path to the directory containing the daily log folders
 DOWNLOAD_DIR = os.path.join(os.path.dirname(__file__), '..', 'downloaded_files', 'trio-oref-validation', 'algorithm-comparisons')
 DAYS_TO_PROCESS = 7
+CACHE_FILE = os.path.join(os.path.dirname(__file__), '..', 'downloaded_files', 'stats_cache.pickle')
+# Bump to invalidate cached partials when their layout changes
+CACHE_VERSION = 2
+
+COUNTER_KEYS = ['errors_by_day', 'errors_by_function', 'errors_by_oref_version', 'errors_by_device', 'errors_by_swift_version']
 
 def process_record(record, stats, day_str, function_name, device_id, app_version):
     """Processes a single record and updates statistics."""
@@ -27,8 +47,11 @@ def process_record(record, stats, day_str, function_name, device_id, app_version
     js_duration = record.get('jsDuration')
     swift_duration = record.get('swiftDuration')
     if js_duration is not None and swift_duration is not None:
-        stats['timing_data'][function_name]['js_durations'].append(js_duration)
-        stats['timing_data'][function_name]['swift_durations'].append(swift_duration)
+        for timing in (stats['timing_data'][function_name], stats['timing_by_version'][(function_name, app_version)]):
+            timing['js'].add(js_duration)
+            timing['swift'].add(swift_duration)
+        if 'columns' in stats:
+            stats['columns'].add(function_name, js_duration, swift_duration, app_version, device_id, day_str, result_type == 'matching')
 
     if result_type != 'matching':
         stats['total_errors'] += 1
@@ -38,9 +61,12 @@ def process_record(record, stats, day_str, function_name, device_id, app_version
         stats['errors_by_oref_version'][app_version] += 1
         stats['errors_by_swift_version'][app_version] += 1
 
-def calculate_stats():
-    """Calculates and prints statistics from downloaded logs."""
-    stats = {
+def _new_timing():
+    return {'js': DurationSummary(), 'swift': DurationSummary()}
+
+def new_stats():
+    """Returns an empty statistics dict, also used for per-file partial results."""
+    return {
         'total_comparisons': 0,
         'total_errors': 0,
         'errors_by_day': Counter(),
@@ -48,47 +74,166 @@ def calculate_stats():
         'errors_by_oref_version': Counter(),
         'errors_by_device': Counter(),
         'errors_by_swift_version': Counter(),
-        'timing_data': defaultdict(lambda: defaultdict(list)) # Store durations for timing analysis
+        'timing_data': defaultdict(_new_timing), # Duration summaries by function
+        'timing_by_version': defaultdict(_new_timing) # Duration summaries by (function, app_version)
     }
 
+def merge_stats(stats, partial):
+    """Folds a partial result into `stats`.
+
+    Merging partials in file order gives the same counts, key order and
+    duration order as processing the files one after another.
+    """
+    stats['total_comparisons'] += partial['total_comparisons']
+    stats['total_errors'] += partial['total_errors']
+    for key in COUNTER_KEYS:
+        stats[key].update(partial[key])
+    for timing_key in ('timing_data', 'timing_by_version'):
+        for key, timing in partial[timing_key].items():
+            stats[timing_key][key]['js'].merge(timing['js'])
+            stats[timing_key][key]['swift'].merge(timing['swift'])
+    if 'columns' in partial:
+        stats.setdefault('columns', TimingColumns()).merge(partial['columns'])
+    return stats
+
+def list_log_files():
+    """Returns (filepath, day_str, packed) for every log file in the last DAYS_TO_PROCESS days.
+
+    `packed` is the PackedBatch of a file that has been packed, None for a
+    loose file. A loose file wins over a packed copy of itself.
+    """
+    log_files = []
     today = datetime.date.today()
     for i in range(DAYS_TO_PROCESS):
         date = today - datetime.timedelta(days=i)
         day_str = date.strftime('%Y-%m-%d')
         day_path = os.path.join(DOWNLOAD_DIR, day_str)
 
-        if not os.path.exists(day_path):
-            continue
-
+        loose = set()
         for root, _, files in os.walk(day_path):
             for filename in files:
-                if filename.endswith(".json"):
-                    filepath = os.path.join(root, filename)
-                    
-                    # Extract metadata from path
-                    try:
-                        # Path is .../{date}/{app_version}/{function}/{device_id}/{file}.json
-                        path_parts = root.split(os.sep)
-                        device_id = path_parts[-1]
-                        function_name = path_parts[-2]
-                        app_version = path_parts[-3]
-                    except IndexError:
-                        print(f"Warning: Could not extract metadata from path: {filepath}")
-                        continue # Skip if path is malformed
-
-                    with open(filepath, 'r') as f:
-                        try:
-                            content = json.load(f)
-                            records = content if isinstance(content, list) else [content]
-                            
-                            for record in records:
-                                process_record(record, stats, day_str, function_name, device_id, app_version)
-
-                        except json.JSONDecodeError:
-                            print(f"Warning: Could not decode JSON from {filepath}")
-    
+                if filename.endswith(BATCH_SUFFIXES):
+                    loose.add(os.path.join(root, filename))
+                    log_files.append((os.path.join(root, filename), day_str, None))
+        for batch in iter_packed_batches(day_str, base_dir=DOWNLOAD_DIR):
+            if batch.path not in loose:
+                log_files.append((batch.path, day_str, batch.packed))
+    return log_files
+
+def process_file(log_file, columns=False):
+    """Computes the partial statistics for one log file.
+
+    Warnings are captured in the partial's 'output' so they can be printed
+    in file order, whichever worker produced them. With `columns`, the
+    partial also holds the paired timings as TimingColumns.
+    """
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        stats = _process_file(log_file, columns)
+    stats['output'] = output.getvalue()
+    # Plain dicts so partials unpickle without this module's helpers
+    stats['timing_data'] = dict(stats['timing_data'])
+    stats['timing_by_version'] = dict(stats['timing_by_version'])
+    return stats
+
+def _process_file(log_file, columns):
+    filepath, day_str, packed = log_file
+    stats = new_stats()
+    if columns:
+        stats['columns'] = TimingColumns()
+
+    # Extract metadata from path
+    try:
+        # Path is .../{date}/{app_version}/{function}/{device_id}/{file}.json
+        path_parts = os.path.dirname(filepath).split(os.sep)
+        device_id = path_parts[-1]
+        function_name = path_parts[-2]
+        app_version = path_parts[-3]
+    except IndexError:
+        print(f"Warning: Could not extract metadata from path: {filepath}")
+        return stats # Skip if path is malformed
+
+    try:
+        for record in iter_records(filepath) if packed is None else iter_packed_records(packed):
+            process_record(record, stats, day_str, function_name, device_id, app_version)
+
+    except json.JSONDecodeError:
+        print(f"Warning: Could not decode JSON from {filepath}")
+        # Like a failed json.load, a file that does not decode contributes nothing
+        stats = new_stats()
+        if columns:
+            stats['columns'] = TimingColumns()
+        return stats
+
     return stats
 
+def cache_version():
+    """Identifies the aggregation code, so cached partials are dropped when it changes.
+
+    Hashes everything that shapes a partial: how records are counted, the
+    partial's layout and the summary and column classes pickled inside it.
+    CACHE_VERSION is still there for changes outside this code.
+    """
+    shaping = [process_record, _process_file, process_file, new_stats, _new_timing, merge_stats,
+               DurationSummary, TimingColumns, timing_columns._FunctionColumns, timing_columns._StringCodes]
+    source = ''.join(inspect.getsource(code) for code in shaping)
+    return f"{CACHE_VERSION}:{hashlib.sha1(source.encode('utf-8')).hexdigest()}"
+
+def calculate_stats(workers=None, use_cache=True, columns=False):
+    """Calculates statistics from downloaded logs.
+
+    Each file is reduced to a partial result in a pool of `workers`
+    processes (all cores by default, 1 to stay in this process) and the
+    partials are merged in file order. With `use_cache`, partials of files
+    unchanged since the last run are loaded from CACHE_FILE instead. With
+    `columns`, stats['columns'] holds every timed comparison as TimingColumns.
+    """
+    log_files = list_log_files()
+    stats = new_stats()
+
+    cache = StatsCache(CACHE_FILE, cache_version(), DOWNLOAD_DIR) if use_cache else None
+    cached = []
+    misses = []
+    for log_file in log_files:
+        filepath, _, packed = log_file
+        # A packed file is identified by where its block is, a repack moves it
+        identity = None if packed is None else ('packed', packed.block_offset, packed.block_length)
+        partial, identity = cache.get(filepath, require=['columns'] if columns else (), identity=identity) if cache else (None, None)
+        cached.append((partial, identity))
+        if partial is None:
+            misses.append(log_file)
+
+    process = functools.partial(process_file, columns=columns)
+    if workers == 1 or not misses:
+        pool = None
+        computed = map(process, misses)
+    else:
+        pool = multiprocessing.Pool(workers)
+        chunksize = max(1, len(misses) // ((workers or os.cpu_count() or 1) * 8))
+        computed = pool.imap(process, misses, chunksize=chunksize)
+
+    try:
+        for log_file, (partial, identity) in zip(log_files, cached):
+            if partial is None:
+                partial = next(computed)
+                if cache:
+                    cache.put(log_file[0], identity, partial)
+            _merge_partial(stats, partial)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    if cache:
+        cache.save(log_file[0] for log_file in log_files)
+        print(f"Stats cache: {cache.hits} files reused, {cache.misses} files parsed")
+
+    return stats
+
+def _merge_partial(stats, partial):
+    print(partial['output'], end='')
+    merge_stats(stats, partial)
+
 def print_stats(stats):
     """Prints a formatted report of the statistics."""
     print("\n--- Statistics Report (Last 7 days) ---")
@@ -117,13 +262,13 @@ def print_stats(stats):
         print(f"  {device}: {count}")
 
     print("\n--- Timing Statistics by Function ---")
-    for function, durations in stats['timing_data'].items():
-        js_durations = durations['js_durations']
-        swift_durations = durations['swift_durations']
+    for function, timing in stats['timing_data'].items():
+        js_timing = timing['js']
+        swift_timing = timing['swift']
 
-        if js_durations and swift_durations:
-            avg_js = sum(js_durations) / len(js_durations)
-            avg_swift = sum(swift_durations) / len(swift_durations)
+        if js_timing.count and swift_timing.count:
+            avg_js = js_timing.mean
+            avg_swift = swift_timing.mean
             avg_diff = avg_swift - avg_js
 
             print(f"\n{function}:")
@@ -131,18 +276,49 @@ def print_stats(stats):
             print(f"  Avg Swift Duration: {avg_swift:.4f}")
             print(f"  Avg Difference (Swift - JS): {avg_diff:.4f}")
             print(f"  {'(Swift slower)' if avg_diff > 0 else '(Same)' if avg_diff == 0 else '(Swift faster)'}")
+            print(f"  JS p50/p90/p99: {format_percentiles(js_timing)}")
+            print(f"  Swift p50/p90/p99: {format_percentiles(swift_timing)}")
+
+    print("\n--- Timing Percentiles by Function and App Version ---")
+    for (function, version), timing in sorted(stats['timing_by_version'].items()):
+        if timing['js'].count and timing['swift'].count:
+            print(f"\n{function} @ {version} ({timing['js'].count} timed comparisons):")
+            print(f"  JS p50/p90/p99: {format_percentiles(timing['js'])}")
+            print(f"  Swift p50/p90/p99: {format_percentiles(timing['swift'])}")
 
     print("------------------------\n")
 
+def format_percentiles(summary):
+    return ' / '.join(f"{summary.quantile(q):.4f}" for q in (0.5, 0.9, 0.99))
+
 def main():
     """Main function to run the script."""
+    parser = argparse.ArgumentParser(description="Print statistics for the downloaded comparison logs.")
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes (default: all cores, 1 disables the pool)")
+    parser.add_argument('--no-cache', action='store_true', help="Parse every file and leave the stats cache untouched")
+    parser.add_argument('--rebuild-cache', action='store_true', help="Discard the stats cache and parse every file")
+    parser.add_argument('--analysis', action='store_true', help="Also print per-record JS vs Swift speedup analysis (requires numpy)")
+    args = parser.parse_args()
+
     if not os.path.exists(DOWNLOAD_DIR):
         print(f"Error: Download directory not found at {DOWNLOAD_DIR}")
         print("Please run the download script first.")
         return
 
-    stats = calculate_stats()
+    if args.rebuild_cache and os.path.exists(CACHE_FILE):
+        os.remove(CACHE_FILE)
+
+    if args.analysis:
+        try:
+            import numpy # noqa: F401
+        except ImportError:
+            print("Error: --analysis requires numpy, install it with `pip install numpy`")
+            return
+
+    stats = calculate_stats(workers=args.workers, use_cache=not args.no_cache, columns=args.analysis)
     print_stats(stats)
+    if args.analysis and 'columns' in stats:
+        print_analysis(analyze(stats['columns']))
 
 if __name__ == "__main__":
     main()
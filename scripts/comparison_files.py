@@ -0,0 +1,106 @@
+"""Enumerates downloaded comparison batch files.
+
+Batches live under DOWNLOAD_DIR as
+{date}/{app_version}/{function}/{device_id}/{file}.json, or .json.gz
+for gzipped uploads, until pack_comparisons.py moves them into the packed
+archive of their day (see packed_archive.py).
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from packed_archive import PackedBatch, PackedPartition, iter_packed_records, packed_functions
+from records import iter_records
+
+DOWNLOAD_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'downloaded_files', 'trio-oref-validation', 'algorithm-comparisons'))
+PACKED_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'downloaded_files', 'trio-oref-validation', 'packed-comparisons'))
+
+# Function names as the API writes them
+FUNCTIONS = ['autosens', 'determineBasal', 'iob', 'makeProfile', 'meal']
+
+BATCH_SUFFIXES = ('.json', '.json.gz')
+
+
+class Batch(NamedTuple):
+    """One batch file, `packed` says where its records are once it is packed."""
+    path: str
+    date: str
+    app_version: str
+    function: str
+    device_id: str
+    packed: Optional[PackedBatch] = None
+
+
+def batch_name(path):
+    """The batch ID of a batch file, without its .json or .json.gz suffix."""
+    filename = os.path.basename(path)
+    for suffix in BATCH_SUFFIXES[::-1]:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return os.path.splitext(filename)[0]
+
+
+def date_range(start, end=None):
+    """Return the YYYY-MM-DD days from `start` through `end` inclusive."""
+    first = datetime.strptime(start, "%Y-%m-%d")
+    last = datetime.strptime(end, "%Y-%m-%d") if end else first
+    return [(first + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((last - first).days + 1)]
+
+
+def _subdirs(path):
+    try:
+        return sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+def iter_loose_batches(dates, functions=None, versions=None, base_dir=DOWNLOAD_DIR):
+    """Yield a Batch for each batch file that is not packed yet."""
+    for date in dates:
+        date_dir = os.path.join(base_dir, date)
+        for app_version in _subdirs(date_dir):
+            if versions is not None and app_version not in versions:
+                continue
+            for function_name in _subdirs(os.path.join(date_dir, app_version)):
+                if functions is not None and function_name not in functions:
+                    continue
+                function_dir = os.path.join(date_dir, app_version, function_name)
+                for device_id in _subdirs(function_dir):
+                    device_dir = os.path.join(function_dir, device_id)
+                    for filename in sorted(os.listdir(device_dir)):
+                        if filename.endswith(BATCH_SUFFIXES):
+                            yield Batch(os.path.join(device_dir, filename), date, app_version, function_name, device_id)
+
+
+def iter_packed_batches(date, functions=None, versions=None, base_dir=DOWNLOAD_DIR, packed_dir=PACKED_DIR):
+    """Yield a Batch for each packed batch of `date`."""
+    for function_name in packed_functions(date, packed_dir):
+        if functions is not None and function_name not in functions:
+            continue
+        partition = PackedPartition(date, function_name, packed_dir)
+        for entry in partition.entries():
+            if versions is not None and entry['app_version'] not in versions:
+                continue
+            yield Batch(os.path.join(base_dir, *entry['path'].split('/')), date, entry['app_version'], function_name,
+                        entry['device_id'], partition.batch(entry))
+
+
+def iter_batch_files(dates, functions=None, versions=None, base_dir=DOWNLOAD_DIR, packed_dir=PACKED_DIR):
+    """Yield a Batch for each batch, loose or packed, in path order.
+
+    `functions` and `versions` restrict the scan, None means all of them. A
+    loose file wins over a packed copy of the same batch.
+    """
+    for date in dates:
+        batches = {batch.path: batch for batch in iter_packed_batches(date, functions, versions, base_dir, packed_dir)}
+        batches.update((batch.path, batch) for batch in iter_loose_batches([date], functions, versions, base_dir))
+        for path in sorted(batches, key=lambda path: path.split(os.sep)):
+            yield batches[path]
+
+
+def iter_batch_records(batch):
+    """Yield the records of a Batch, whether it is loose or packed."""
+    if batch.packed is None:
+        return iter_records(batch.path)
+    return iter_packed_records(batch.packed)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""SQLite index of the downloaded comparison records.
+
+Each indexed record keeps its path metadata (date, app version, function,
+device), the fields used to triage errors and its byte span in the batch
+file, so queries never reparse the batches and matching records can be read
+back individually. `update` only reindexes batch files whose size or mtime
+changed since the last run and drops rows for files that were removed.
+`query` answers from the index as it is, update_trio_stats.sh updates it
+after each download, or pass `--update` to update it first.
+Packed batches (see packed_archive.py) are indexed like loose ones, with
+their record spans inside the decompressed block of their archive.
+
+    python scripts/comparison_index.py update
+    python scripts/comparison_index.py query --date 2025-06-20 --function iob --not-matching
+    python scripts/comparison_index.py query --date 2025-06-20 --function iob --not-matching --raw
+    python scripts/comparison_index.py query --date 2025-06-20 --not-matching --count --update
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from comparison_files import BATCH_SUFFIXES, PACKED_DIR, iter_packed_batches
+from packed_archive import PackedBatch, iter_packed_records, packed_dates, read_packed_record
+from records import iter_record_spans, read_record_at
+
+DOWNLOAD_DIR = os.path.join(os.path.dirname(__file__), '..', 'downloaded_files', 'trio-oref-validation', 'algorithm-comparisons')
+INDEX_FILE = os.path.join(os.path.dirname(__file__), '..', 'downloaded_files', 'comparison_index.sqlite')
+# Bump when the schema or the extracted fields change to rebuild the index
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    app_version TEXT NOT NULL,
+    function TEXT NOT NULL,
+    device_id TEXT NOT NULL,
+    pack TEXT,
+    block_offset INTEGER,
+    block_length INTEGER
+);
+CREATE TABLE IF NOT EXISTS records (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    date TEXT NOT NULL,
+    app_version TEXT NOT NULL,
+    function TEXT NOT NULL,
+    device_id TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    created_at REAL,
+    result_type TEXT,
+    is_simulator INTEGER NOT NULL,
+    timezone TEXT,
+    js_duration REAL,
+    swift_duration REAL
+);
+CREATE INDEX IF NOT EXISTS records_by_date ON records (date, function, result_type);
+CREATE INDEX IF NOT EXISTS records_by_function ON records (function, app_version, result_type);
+CREATE INDEX IF NOT EXISTS records_by_device ON records (device_id, date);
+CREATE INDEX IF NOT EXISTS records_by_file ON records (file_id);
+"""
+
+
+class ComparisonIndex:
+    def __init__(self, path=INDEX_FILE, base_dir=DOWNLOAD_DIR, packed_dir=PACKED_DIR):
+        self.path = path
+        self.base_dir = base_dir
+        self.packed_dir = packed_dir
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.conn.executescript("DROP TABLE IF EXISTS records; DROP TABLE IF EXISTS files;")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _batch_files(self):
+        """Yield (relative path, date, app_version, function, device_id, packed) for every batch.
+
+        `packed` is the PackedBatch of a packed batch, a loose file wins over
+        a packed copy of itself.
+        """
+        loose = set()
+        for root, _, files in os.walk(self.base_dir):
+            for filename in files:
+                if not filename.endswith(BATCH_SUFFIXES):
+                    continue
+                relpath = os.path.relpath(os.path.join(root, filename), self.base_dir)
+                # Path is {date}/{app_version}/{function}/{device_id}/{file}.json(.gz)
+                parts = relpath.split(os.sep)
+                if len(parts) != 5:
+                    continue
+                loose.add(relpath)
+                yield relpath, parts[0], parts[1], parts[2], parts[3], None
+
+        for date in packed_dates(self.packed_dir):
+            for batch in iter_packed_batches(date, base_dir=self.base_dir, packed_dir=self.packed_dir):
+                relpath = os.path.relpath(batch.path, self.base_dir)
+                if relpath not in loose:
+                    yield relpath, date, batch.app_version, batch.function, batch.device_id, batch.packed
+
+    def _identity(self, relpath, packed):
+        """(size, mtime_ns, pack, block_offset, block_length) as stored in `files`."""
+        if packed is None:
+            st = os.stat(os.path.join(self.base_dir, relpath))
+            return st.st_size, st.st_mtime_ns, None, None, None
+        return -1, -1, os.path.relpath(packed.pack_path, self.packed_dir), packed.block_offset, packed.block_length
+
+    def update(self):
+        """Index new and changed batch files, returning (indexed, unchanged, removed) counts."""
+        known = {row['path']: (row['id'], row['size'], row['mtime_ns'], row['pack'], row['block_offset'], row['block_length'])
+                 for row in self.conn.execute("SELECT id, path, size, mtime_ns, pack, block_offset, block_length FROM files")}
+        indexed = unchanged = 0
+
+        for relpath, date, app_version, function_name, device_id, packed in self._batch_files():
+            identity = self._identity(relpath, packed)
+            entry = known.pop(relpath, None)
+            if entry is not None and entry[1:] == identity:
+                unchanged += 1
+                continue
+
+            with self.conn:
+                if entry is not None:
+                    self.conn.execute("DELETE FROM files WHERE id = ?", (entry[0],))
+                file_id = self.conn.execute(
+                    "INSERT INTO files (path, size, mtime_ns, pack, block_offset, block_length, date, app_version, function, device_id) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (relpath, *identity, date, app_version, function_name, device_id)).lastrowid
+                rows = self._record_rows(relpath, packed, file_id, (date, app_version, function_name, device_id))
+                self.conn.executemany("INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            indexed += 1
+
+        # Whatever is left in `known` was deleted from disk
+        with self.conn:
+            self.conn.executemany("DELETE FROM files WHERE id = ?", [(entry[0],) for entry in known.values()])
+        return indexed, unchanged, len(known)
+
+    def _record_rows(self, relpath, packed, file_id, metadata):
+        rows = []
+        if packed is None:
+            spans = iter_record_spans(os.path.join(self.base_dir, relpath))
+        else:
+            spans = ((offset, length, record) for (offset, length), record in zip(packed.spans, iter_packed_records(packed)))
+        try:
+            for offset, length, record in spans:
+                if not isinstance(record, dict):
+                    continue
+                rows.append((file_id, *metadata, offset, length, record.get('createdAt'), record.get('resultType'),
+                             1 if record.get('isSimulator', False) else 0, record.get('timezone'),
+                             record.get('jsDuration'), record.get('swiftDuration')))
+        except json.JSONDecodeError as e:
+            # Keep the records before the error, the file is retried once it changes
+            print(f"Warning: Could not decode JSON from {relpath}: {e}", file=sys.stderr)
+        return rows
+
+    def query(self, date=None, until=None, function_name=None, app_version=None, device_id=None,
+              result_type=None, not_matching=False, include_simulator=False, limit=None):
+        """Return the matching records joined with their batch file path."""
+        clauses = []
+        params = []
+        if date is not None and until is not None:
+            clauses.append("r.date BETWEEN ? AND ?")
+            params += [date, until]
+        elif date is not None:
+            clauses.append("r.date = ?")
+            params.append(date)
+        for column, value in (('function', function_name), ('app_version', app_version), ('device_id', device_id), ('result_type', result_type)):
+            if value is not None:
+                clauses.append(f"r.{column} = ?")
+                params.append(value)
+        if not_matching:
+            clauses.append("r.result_type IS NOT 'matching'")
+        if not include_simulator:
+            clauses.append("r.is_simulator = 0")
+
+        sql = "SELECT r.*, f.path, f.pack, f.block_offset, f.block_length FROM records r JOIN files f ON f.id = r.file_id"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY f.path, r.offset"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self.conn.execute(sql, params).fetchall()
+
+    def read_record(self, row):
+        """Read one indexed record back from its batch file or packed block."""
+        if row['pack'] is None:
+            return read_record_at(os.path.join(self.base_dir, row['path']), row['offset'], row['length'])
+        packed = PackedBatch(os.path.join(self.packed_dir, row['pack']), row['block_offset'], row['block_length'], ((row['offset'], row['length']),))
+        return read_packed_record(packed, 0)
+
+def print_row(row):
+    created_at = row['created_at']
+    when = datetime.fromtimestamp(created_at).strftime('%Y-%m-%d %H:%M:%S') if created_at is not None else 'unknown time'
+    print(f"{row['date']} {row['app_version']} {row['function']} {row['device_id']} {row['result_type']} @ {when} "
+          f"({row['timezone']}) {row['path']}:{row['offset']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index downloaded comparison records and query them.")
+    parser.add_argument('--index', default=INDEX_FILE, help="Path of the SQLite index")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('update', help="Index new and changed batch files")
+
+    query_parser = subparsers.add_parser('query', help="List indexed records")
+    query_parser.add_argument('--date', help="YYYY-MM-DD, or the first day with --until")
+    query_parser.add_argument('--until', help="Last day (inclusive) of a date range")
+    query_parser.add_argument('--function', help="e.g. iob, determineBasal")
+    query_parser.add_argument('--version', help="App version, any version if omitted")
+    query_parser.add_argument('--device', help="Device ID")
+    query_parser.add_argument('--result-type', help="Exact resultType, e.g. jsError")
+    query_parser.add_argument('--not-matching', action='store_true', help="Only records whose resultType is not 'matching'")
+    query_parser.add_argument('--include-simulator', action='store_true', help="Include simulator records")
+    query_parser.add_argument('--limit', type=int, help="Return at most this many records")
+    query_parser.add_argument('--update', action='store_true', help="Index new and changed batch files before querying, which walks the whole download tree")
+    output = query_parser.add_mutually_exclusive_group()
+    output.add_argument('--count', action='store_true', help="Only print the number of matching records")
+    output.add_argument('--raw', action='store_true', help="Print the full records as a JSON array")
+    args = parser.parse_args()
+
+    index = ComparisonIndex(args.index)
+    try:
+        if args.command == 'update' or args.update:
+            start = time.monotonic()
+            indexed, unchanged, removed = index.update()
+            # Keep stdout clean for --raw and --count
+            print(f"Index: {indexed} files indexed, {unchanged} unchanged, {removed} removed in {time.monotonic() - start:.2f}s", file=sys.stderr)
+        if args.command == 'update':
+            return
+        if index.conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None:
+            print("Index is empty, run `comparison_index.py update` or pass --update", file=sys.stderr)
+
+        rows = index.query(date=args.date, until=args.until, function_name=args.function, app_version=args.version,
+                           device_id=args.device, result_type=args.result_type, not_matching=args.not_matching,
+                           include_simulator=args.include_simulator, limit=args.limit)
+        if args.count:
+            print(len(rows))
+        elif args.raw:
+            json.dump([index.read_record(row) for row in rows], sys.stdout, indent=2)
+            print()
+        else:
+            for row in rows:
+                print_row(row)
+    finally:
+        index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import json
+import os
+
+
+# Compact once the journal has this many times more lines than live entries
+COMPACT_RATIO = 2
+MIN_COMPACT_LINES = 1000
+
+
+class DownloadManifest:
+    """Append-only journal of downloaded blobs.
+
+    Each line is a JSON object with the blob's name, updated timestamp,
+    generation and crc32c, and later lines win. Recording a download is a
+    single appended line, and the journal is rewritten atomically once it
+    holds mostly superseded lines. A line cut short by a crash is dropped
+    on load.
+    """
+
+    def __init__(self, path, legacy_path=None):
+        self.path = str(path)
+        self.legacy_path = str(legacy_path) if legacy_path else None
+        self.entries = {}
+        self._lines = 0
+        self._file = None
+        self.load()
+
+    def load(self):
+        """Replay the journal, migrating the old JSON tracking file if needed."""
+        if not os.path.exists(self.path) and self.legacy_path and os.path.exists(self.legacy_path):
+            self._migrate_legacy()
+            return
+
+        self.entries = {}
+        self._lines = 0
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        # Drop a trailing partial line so the next append starts cleanly
+        complete = data.rfind(b'\n') + 1
+        if complete < len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(complete)
+
+        for line in data[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            self.entries[entry['name']] = entry
+            self._lines += 1
+
+    def _migrate_legacy(self):
+        """Convert the old {name: updated} JSON file into a journal."""
+        with open(self.legacy_path, 'r') as f:
+            legacy = json.load(f)
+        self.entries = {
+            name: {'name': name, 'updated': updated, 'generation': None, 'crc32c': None}
+            for name, updated in legacy.items()
+        }
+        self.compact()
+        os.replace(self.legacy_path, self.legacy_path + '.migrated')
+        print(f"Migrated {len(self.entries)} entries from {self.legacy_path} to {self.path}")
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def record(self, blob):
+        """Record a downloaded blob with one appended line."""
+        entry = {
+            'name': blob.name,
+            'updated': blob.updated.isoformat(),
+            'generation': getattr(blob, 'generation', None),
+            'crc32c': getattr(blob, 'crc32c', None),
+        }
+        self.entries[blob.name] = entry
+
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(json.dumps(entry) + '\n')
+        self._file.flush()
+        self._lines += 1
+
+        if self._lines > max(MIN_COMPACT_LINES, COMPACT_RATIO * len(self.entries)):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the journal with one line per blob."""
+        self.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self._lines = len(self.entries)
+
+    def close(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
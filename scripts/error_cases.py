@@ -0,0 +1,85 @@
+"""Content-addressed identities for extracted error cases.
+
+Two error records are the same replay case when their inputs and timezone
+are the same, whichever device, batch or time reported them. case_hash()
+hashes a canonical JSON encoding of just those fields. CaseIndex counts the
+occurrences of each case with the devices, app versions and result types
+that reported it.
+"""
+
+import hashlib
+import json
+from collections import Counter
+
+# Fields that describe a report rather than the replayed input
+VOLATILE_FIELDS = {'createdAt', 'deviceId', 'isSimulator', 'jsDuration', 'swiftDuration', 'resultType'}
+
+
+def case_payload(record):
+    """Return the part of `record` that determines its replay.
+
+    That is every `*Input` field, as it is, plus the timezone the test runs
+    in. Timestamps inside the inputs are part of the replay. Records without
+    input fields fall back to everything but the top-level VOLATILE_FIELDS.
+    """
+    payload = {key: value for key, value in record.items() if key.endswith('Input')}
+    if not payload:
+        return {key: value for key, value in record.items() if key not in VOLATILE_FIELDS}
+    payload['timezone'] = record.get('timezone')
+    return payload
+
+
+def case_hash(record):
+    """Hex digest of the canonical JSON of case_payload(record)."""
+    canonical = json.dumps(case_payload(record), sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(canonical.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class CaseIndex:
+    """Occurrences of each distinct error case, keyed by case_hash()."""
+
+    def __init__(self, cases=None):
+        self.cases = cases if cases is not None else {}
+
+    def __len__(self):
+        return len(self.cases)
+
+    def add(self, record, device_id, app_version, source):
+        """Count one occurrence of `record`, return (case hash, True if it is a new case)."""
+        digest = case_hash(record)
+        case = self.cases.get(digest)
+        is_new = case is None
+        if is_new:
+            case = self.cases[digest] = {
+                'count': 0,
+                'timezone': record.get('timezone'),
+                'first_seen': source,
+                'devices': Counter(),
+                'versions': Counter(),
+                'result_types': Counter(),
+            }
+        case['count'] += 1
+        case['devices'][device_id] += 1
+        case['versions'][app_version] += 1
+        case['result_types'][record.get('resultType')] += 1
+        return digest, is_new
+
+    def occurrences(self):
+        return sum(case['count'] for case in self.cases.values())
+
+    def to_json(self):
+        """Cases ordered by how often they occur, most frequent first."""
+        ordered = sorted(self.cases.items(), key=lambda item: -item[1]['count'])
+        return {digest: {**case,
+                         'devices': dict(case['devices']),
+                         'versions': dict(case['versions']),
+                         'result_types': dict(case['result_types'])}
+                for digest, case in ordered}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls({digest: {**case,
+                             'devices': Counter(case['devices']),
+                             'versions': Counter(case['versions']),
+                             'result_types': Counter(case['result_types'])}
+                    for digest, case in data.items()})
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""Extract the non-matching records of a day for every function in one pass.
+
+Each error is written to {output_dir}/{function}/{batch}.{index}.json, in
+the same format as extract_error_results.py. manifest.json in the output
+directory lists, per function, the error count and the files for each
+timezone, so callers never have to re-read the extracted files.
+
+Errors are also grouped into distinct replay cases (see error_cases.py),
+recorded in {output_dir}/{function}.cases.json next to the served
+directory. With `unique`, each case is written once as {case hash}.json.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from collections import defaultdict
+
+from comparison_files import DOWNLOAD_DIR, FUNCTIONS, batch_name, date_range, iter_batch_files, iter_batch_records
+from error_cases import CaseIndex
+
+OUTPUT_DIR = 'extracted_errors'
+MANIFEST_FILE = 'manifest.json'
+# files_by_timezone key for records without a timezone
+UNKNOWN_TIMEZONE = 'unknown'
+
+
+def extract_day_errors(date, until=None, output_dir=OUTPUT_DIR, functions=FUNCTIONS, versions=None, unique=False):
+    """Extract the errors for `date` (through `until`) and return the manifest."""
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    for function_name in functions:
+        os.makedirs(os.path.join(output_dir, function_name))
+
+    dates = date_range(date, until)
+    files_by_timezone = {function_name: defaultdict(list) for function_name in functions}
+    cases = {function_name: CaseIndex() for function_name in functions}
+    for batch in iter_batch_files(dates, functions=functions, versions=versions):
+        path, app_version, function_name, device_id = batch.path, batch.app_version, batch.function, batch.device_id
+        logfile = batch_name(path)
+        try:
+            for index, record in enumerate(iter_batch_records(batch)):
+                # One malformed record must not abort the whole day's extraction
+                if not isinstance(record, dict) or 'resultType' not in record or not isinstance(record.get('timezone'), (str, type(None))):
+                    print(f"Warning: Skipping malformed record {index} in {path}", file=sys.stderr)
+                    continue
+                if record["resultType"] == "matching":
+                    continue
+                filename = f"{logfile}.{index}.json"
+                source = f"{os.path.relpath(path, DOWNLOAD_DIR)}[{index}]"
+                digest, is_new = cases[function_name].add(record, device_id, app_version, source)
+                if unique:
+                    if not is_new:
+                        continue
+                    filename = f"{digest}.json"
+                with open(os.path.join(output_dir, function_name, filename), 'w') as f:
+                    f.write(json.dumps(record, indent=4, sort_keys=True))
+                files_by_timezone[function_name][record.get('timezone') or UNKNOWN_TIMEZONE].append(filename)
+        except json.JSONDecodeError as e:
+            print(f"Warning: Could not decode JSON from {path}: {e}", file=sys.stderr)
+
+    for function_name, index in cases.items():
+        with open(os.path.join(output_dir, f"{function_name}.cases.json"), 'w') as f:
+            json.dump(index.to_json(), f, indent=4)
+
+    manifest = {
+        'dates': dates,
+        'unique': unique,
+        'functions': {
+            function_name: {
+                'errors': cases[function_name].occurrences(),
+                'cases': len(cases[function_name]),
+                'files': sum(len(files) for files in by_timezone.values()),
+                'timezones': sorted(timezone for timezone in by_timezone if timezone != UNKNOWN_TIMEZONE),
+                'files_by_timezone': dict(by_timezone),
+            }
+            for function_name, by_timezone in files_by_timezone.items()
+        },
+    }
+    tmp_path = os.path.join(output_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, os.path.join(output_dir, MANIFEST_FILE))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the non-matching records of a day, grouped by function.")
+    parser.add_argument('date', help="YYYY-MM-DD, the first day with --until")
+    parser.add_argument('--until', help="Last day (inclusive) of a date range")
+    parser.add_argument('--function', action='append', choices=FUNCTIONS, help="Only extract this function, may be repeated")
+    parser.add_argument('--version', action='append', help="Only extract this app version, may be repeated")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, help="Directory to write the errors and manifest to, replaced if it exists")
+    parser.add_argument('--unique', action='store_true', help="Write each distinct error case once instead of every occurrence")
+    args = parser.parse_args()
+
+    try:
+        date_range(args.date, args.until)
+    except ValueError:
+        parser.error("dates must be YYYY-MM-DD")
+
+    manifest = extract_day_errors(args.date, until=args.until, output_dir=args.output_dir,
+                                  functions=args.function or FUNCTIONS, versions=args.version, unique=args.unique)
+
+    for function_name, entry in manifest['functions'].items():
+        timezones = ', '.join(entry['timezones']) or 'none'
+        print(f"{function_name}: {entry['errors']} errors, {entry['cases']} distinct cases, timezones: {timezones}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,16 @@
 from datetime import datetime
 import json
-import os
 import sys
 
+from comparison_files import batch_name
+from records import iter_records
+
 if len(sys.argv) != 2:
     print(f"Usage: {sys.argv[0]} logfile.json")
     sys.exit(1)
 
-iob_results = json.loads(open(sys.argv[1]).read())
-logfile = os.path.splitext(os.path.basename(sys.argv[1]))[0]
-for index, iob_result in enumerate(iob_results):
+logfile = batch_name(sys.argv[1])
+for index, iob_result in enumerate(iter_records(sys.argv[1])):
     result = iob_result["resultType"]
     if result != "matching":
         filename = f"{logfile}.{index}.json"
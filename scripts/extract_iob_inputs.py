@@ -2,15 +2,17 @@ from datetime import datetime
 import json
 import sys
 
-iob_results = json.loads(sys.stdin.read())
+from records import iter_records
 
 if len(sys.argv) != 2:
     print(f"Usage: {sys.argv[0]} index < log_file.json > inputs.json")
+    sys.exit(1)
 
 print_index = int(sys.argv[1])
     
-for index, iob_result in enumerate(iob_results):
+for index, iob_result in enumerate(iter_records(sys.stdin.buffer)):
     if index == print_index:
         inputs = iob_result["iobInput"]
         print(json.dumps(inputs, indent=4, sort_keys=True))
+        break
         
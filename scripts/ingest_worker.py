@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+"""Long-running worker that ingests new comparison batches as they arrive.
+
+Each new batch is downloaded with LocalDownloader (into the same tree and
+download manifest as update_trio_stats.sh), decoded once and folded into
+running state:
+
+- the statistics calculate_stats.py prints: error counts by day, function,
+  version and device, and JS/Swift duration summaries
+- the distinct error cases per function (see error_cases.py), with each
+  new case written to {output_dir}/ingested_errors/{function}/{hash}.json
+
+The state and the set of ingested batches are saved together atomically
+after every poll or pull, and {output_dir}/ingest_summary.json is rewritten
+with the current counts. A batch is only counted once its state is saved,
+so after a crash or restart every batch is counted exactly once.
+
+New batches are found from GCS object notifications on a Pub/Sub
+subscription (--subscription, needs google-cloud-pubsub), or by listing
+today's partition (and --lookback-days before it) every --interval seconds,
+and the partitions of the last --retain-days every 10 minutes for batches
+that devices upload days after they were created.
+
+Batches uploaded more than --retain-days ago are skipped, which keeps the
+set of ingested batch names bounded. Skipped batches are reported and
+counted in the summary. Polling never sees late uploads dated before the
+--retain-days partitions, Pub/Sub notifications cover every upload.
+--source-dir reads a local directory laid out like the bucket instead of
+GCS, for testing.
+
+    python scripts/ingest_worker.py
+    python scripts/ingest_worker.py --subscription projects/trio-oref-logs/subscriptions/comparisons
+    python scripts/ingest_worker.py --source-dir /tmp/fake-bucket --output-dir /tmp/ingest --once
+    python scripts/ingest_worker.py --report
+"""
+
+import argparse
+from datetime import datetime, timedelta, timezone
+import importlib.util
+import json
+import os
+import pickle
+import shutil
+import sys
+import time
+
+from calculate_stats import format_percentiles, merge_stats, new_stats, print_stats, process_record
+from comparison_files import Batch, iter_batch_records, iter_packed_batches
+from error_cases import CaseIndex, case_hash
+
+PREFIX = "trio-oref-validation/algorithm-comparisons/"
+STATE_FILE = 'ingest_state.pickle'
+SUMMARY_FILE = 'ingest_summary.json'
+CASES_DIR = 'ingested_errors'
+DEFAULT_INTERVAL_SECONDS = 10
+DEFAULT_LOOKBACK_DAYS = 1
+DEFAULT_RETAIN_DAYS = 7
+RESCAN_INTERVAL_SECONDS = 600
+MAX_MESSAGES = 100
+
+
+def load_local_downloader():
+    """Import LocalDownloader from local-downloader.py, whose name is not a module name."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'local-downloader.py')
+    spec = importlib.util.spec_from_file_location('local_downloader', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.LocalDownloader
+
+
+class DirectoryBlob:
+    """A file under a DirectoryBucket, with the blob attributes the downloader uses."""
+
+    def __init__(self, root, name):
+        self.name = name
+        self.path = os.path.join(root, *name.split('/'))
+        st = os.stat(self.path)
+        self.size = st.st_size
+        self.updated = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+        self.generation = st.st_mtime_ns
+        self.crc32c = None
+        self.content_encoding = 'gzip' if name.endswith('.gz') else None
+
+    def download_to_filename(self, filename, raw_download=False):
+        shutil.copyfile(self.path, filename)
+
+
+class DirectoryBucket:
+    """Stand-in bucket whose objects are the files under a local directory."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def list_blobs(self, prefix=''):
+        """The files whose path relative to the root starts with `prefix`, in name order."""
+        base = os.path.join(self.root, *prefix.split('/')[:-1])
+        names = []
+        for directory, _, files in os.walk(base):
+            for filename in files:
+                name = os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, '/')
+                # Skip files that are still being written
+                if name.startswith(prefix) and not filename.endswith(('.part', '.tmp')):
+                    names.append(name)
+        return [DirectoryBlob(self.root, name) for name in sorted(names)]
+
+    def get_blob(self, name):
+        try:
+            return DirectoryBlob(self.root, name)
+        except FileNotFoundError:
+            return None
+
+
+class IngestState:
+    """Everything ingested so far, saved as one pickle replaced atomically."""
+
+    def __init__(self, path):
+        self.path = path
+        # blob name -> updated timestamp of the ingested version, for the
+        # days still in the look-back window
+        self.processed = {}
+        self.batch_count = 0
+        self.stats = new_stats()
+        self.cases = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+        self.processed = state['processed']
+        self.batch_count = state.get('batch_count', len(self.processed))
+        self.stats = state['stats']
+        self.cases = state['cases']
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'processed': self.processed, 'batch_count': self.batch_count, 'stats': self.stats, 'cases': self.cases}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class IngestWorker:
+    """Folds new batches into an IngestState.
+
+    Only batches uploaded in the last `retain_days` days are ingested,
+    whatever day their path names. Older ones are dropped from the state's
+    processed set so it stays small, and skipped if they show up again.
+    """
+
+    def __init__(self, downloader, prefix=PREFIX, lookback_days=DEFAULT_LOOKBACK_DAYS, retain_days=DEFAULT_RETAIN_DAYS):
+        self.downloader = downloader
+        self.prefix = prefix
+        self.lookback_days = lookback_days
+        self.retain_days = max(retain_days, lookback_days)
+        # Names of batches skipped as uploaded too long ago, since this process started
+        self.skipped = set()
+        self.last_rescan = None
+        self.output_dir = str(downloader.output_dir)
+        self.cases_dir = os.path.join(self.output_dir, CASES_DIR)
+        # Where pack_comparisons.py moves the loose batches of finished days
+        project = prefix.split('/')[0]
+        self.base_dir = os.path.join(self.output_dir, *prefix.rstrip('/').split('/'))
+        self.packed_dir = os.path.join(self.output_dir, project, 'packed-comparisons')
+        self._packed = {}
+        self.state = IngestState(os.path.join(self.output_dir, STATE_FILE))
+
+    def cutoff(self):
+        """Batches uploaded before this time are no longer ingested."""
+        return datetime.now(timezone.utc) - timedelta(days=self.retain_days)
+
+    def _packed_batch(self, batch):
+        """The packed copy of `batch`, or None. Indexes are read once per poll."""
+        key = (batch.date, batch.function)
+        if key not in self._packed:
+            self._packed[key] = {os.path.normpath(packed.path): packed for packed in
+                                 iter_packed_batches(batch.date, [batch.function], base_dir=self.base_dir, packed_dir=self.packed_dir)}
+        return self._packed[key].get(os.path.normpath(batch.path))
+
+    def ingest(self, blob):
+        """Download and decode one new batch and fold it into the state, return True if it was new."""
+        if blob.name in self.state.processed or not blob.name.startswith(self.prefix):
+            return False
+        # Path is {prefix}{date}/{app_version}/{function}/{device_id}/{file}
+        parts = blob.name[len(self.prefix):].split('/')
+        if len(parts) != 5:
+            return False
+        if blob.updated < self.cutoff():
+            # Its name may have been pruned already, so ingesting it could count it twice
+            if blob.name not in self.skipped:
+                self.skipped.add(blob.name)
+                print(f"Warning: Skipping {blob.name}, uploaded {blob.updated.isoformat()}, more than {self.retain_days} days ago")
+            return False
+        day_str, app_version, function_name, device_id, _ = parts
+
+        batch = Batch(str(self.downloader.local_path(blob)), day_str, app_version, function_name, device_id)
+        if self.downloader.should_process_file(blob):
+            self.downloader.download_blob(blob)
+            self.downloader.record_download(blob)
+        elif not os.path.exists(batch.path):
+            # Downloaded before, but its day may have been packed since
+            packed = self._packed_batch(batch)
+            if packed is not None:
+                batch = packed
+            else:
+                self.downloader.download_blob(blob)
+
+        partial = new_stats()
+        errors = []
+        path = batch.path
+        try:
+            for index, record in enumerate(iter_batch_records(batch)):
+                process_record(record, partial, day_str, function_name, device_id, app_version)
+                if isinstance(record, dict) and record.get('resultType') != 'matching':
+                    errors.append((index, record))
+        except json.JSONDecodeError as e:
+            # Like calculate_stats.py, a batch that does not decode counts for nothing
+            print(f"Warning: Could not decode JSON from {path}: {e}")
+            partial = new_stats()
+            errors = []
+
+        # Everything that can fail happens before the state changes. Case files
+        # are named by content, so writing one again after a crash is harmless.
+        cases = self.state.cases.get(function_name) or CaseIndex()
+        new_cases = {}
+        for _, record in errors:
+            digest = case_hash(record)
+            if digest not in cases.cases and digest not in new_cases:
+                new_cases[digest] = record
+                self._write_case(function_name, digest, record)
+
+        merge_stats(self.state.stats, partial)
+        self.state.cases[function_name] = cases
+        for index, record in errors:
+            cases.add(record, device_id, app_version, f"{blob.name[len(self.prefix):]}[{index}]")
+        self.state.processed[blob.name] = blob.updated.isoformat()
+        self.state.batch_count += 1
+
+        if errors:
+            print(f"{function_name}: {len(errors)} errors ({len(new_cases)} new cases) in {blob.name[len(self.prefix):]}")
+        return True
+
+    def _write_case(self, function_name, digest, record):
+        directory = os.path.join(self.cases_dir, function_name)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{digest}.json"), 'w') as f:
+            f.write(json.dumps(record, indent=4, sort_keys=True))
+
+    def prune(self):
+        """Forget batches uploaded before the cutoff, they are never ingested again."""
+        cutoff = self.cutoff()
+        self.state.processed = {name: updated for name, updated in self.state.processed.items()
+                                if datetime.fromisoformat(updated) >= cutoff}
+
+    def commit(self):
+        """Save the state and summary, making everything ingested so far count."""
+        self.downloader.manifest.close()
+        self.prune()
+        self.state.save()
+
+        stats = self.state.stats
+        summary = {
+            'updated_at': datetime.now(timezone.utc).isoformat(),
+            'batches': self.state.batch_count,
+            # Since the worker started
+            'skipped_too_old': len(self.skipped),
+            'total_comparisons': stats['total_comparisons'],
+            'total_errors': stats['total_errors'],
+            'errors_by_day': dict(sorted(stats['errors_by_day'].items())),
+            'errors_by_function': dict(stats['errors_by_function'].most_common()),
+            'errors_by_oref_version': dict(stats['errors_by_oref_version'].most_common()),
+            'cases_by_function': {function_name: len(cases) for function_name, cases in sorted(self.state.cases.items())},
+            'timing_p50_p90_p99': {
+                function_name: {'js': format_percentiles(timing['js']), 'swift': format_percentiles(timing['swift'])}
+                for function_name, timing in sorted(stats['timing_data'].items()) if timing['js'].count
+            },
+        }
+        tmp_path = os.path.join(self.output_dir, SUMMARY_FILE + '.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f, indent=4)
+        os.replace(tmp_path, os.path.join(self.output_dir, SUMMARY_FILE))
+
+    def try_ingest(self, blob):
+        """ingest(), but a batch that fails to download is reported and left for a retry."""
+        try:
+            return self.ingest(blob)
+        except Exception as e:
+            print(f"Error ingesting {blob.name}: {e}")
+            return None
+
+    def poll(self, rescan=False):
+        """Ingest the new batches of today's partition and the `lookback_days` before it.
+
+        With `rescan`, list the partitions of the last `retain_days` instead.
+        """
+        today = datetime.now(timezone.utc)
+        count = 0
+        skipped = len(self.skipped)
+        self._packed = {}
+        for days in range(self.retain_days if rescan else self.lookback_days, -1, -1):
+            date = (today - timedelta(days=days)).strftime("%Y-%m-%d")
+            for blob in self.downloader.bucket.list_blobs(prefix=f"{self.prefix}{date}/"):
+                count += bool(self.try_ingest(blob))
+        if count or len(self.skipped) != skipped:
+            self.commit()
+        return count
+
+    def run_polling(self, interval=DEFAULT_INTERVAL_SECONDS, once=False):
+        while True:
+            start = time.monotonic()
+            rescan = self.last_rescan is None or start - self.last_rescan >= RESCAN_INTERVAL_SECONDS
+            if rescan:
+                self.last_rescan = start
+            count = self.poll(rescan)
+            if count:
+                print(f"Ingested {count} batches, {self.state.stats['total_errors']} errors in "
+                      f"{self.state.stats['total_comparisons']} comparisons so far")
+            if once:
+                return
+            time.sleep(max(0, interval - (time.monotonic() - start)))
+
+    def run_pubsub(self, subscription, once=False):
+        """Ingest the objects named by GCS notifications, acknowledging them once saved."""
+        from google.cloud import pubsub_v1
+
+        subscriber = pubsub_v1.SubscriberClient()
+        print(f"Listening on {subscription}")
+        while True:
+            response = subscriber.pull(request={'subscription': subscription, 'max_messages': MAX_MESSAGES}, timeout=60)
+            count = 0
+            skipped = len(self.skipped)
+            ack_ids = []
+            self._packed = {}
+            for message in response.received_messages:
+                attributes = message.message.attributes
+                # A deleted object (blob is None) has nothing to ingest
+                blob = self.downloader.bucket.get_blob(attributes['objectId']) if attributes.get('eventType') == 'OBJECT_FINALIZE' else None
+                result = self.try_ingest(blob) if blob is not None else False
+                if result is not None:
+                    # Failed ones are not acknowledged, so they are delivered again
+                    ack_ids.append(message.ack_id)
+                    count += result
+            if count or len(self.skipped) != skipped:
+                self.commit()
+            if count:
+                print(f"Ingested {count} batches, {self.state.stats['total_errors']} errors in "
+                      f"{self.state.stats['total_comparisons']} comparisons so far")
+            # Acknowledged only once saved, a redelivered message is skipped by name
+            if ack_ids:
+                subscriber.acknowledge(request={'subscription': subscription, 'ack_ids': ack_ids})
+            if once:
+                return
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest new comparison batches as they are uploaded.")
+    parser.add_argument('--subscription', help="Pub/Sub subscription with the bucket's object notifications, polls if omitted")
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL_SECONDS, help="Seconds between polls")
+    parser.add_argument('--lookback-days', type=int, default=DEFAULT_LOOKBACK_DAYS,
+                        help="Also poll this many days before today for late uploads")
+    parser.add_argument('--retain-days', type=int, default=DEFAULT_RETAIN_DAYS,
+                        help="Skip batches uploaded longer ago, and rescan this many days every 10 minutes")
+    parser.add_argument('--source-dir', help="Read batches from this directory, laid out like the bucket, instead of GCS")
+    parser.add_argument('--output-dir', default='downloaded_files', help="Download directory, also holds the worker's state")
+    parser.add_argument('--once', action='store_true', help="Poll (or pull) once and exit")
+    parser.add_argument('--report', action='store_true', help="Print the statistics ingested so far and exit")
+    args = parser.parse_args()
+
+    if args.report:
+        state = IngestState(os.path.join(args.output_dir, STATE_FILE))
+        print(f"{state.batch_count} batches ingested")
+        print_stats(state.stats)
+        for function_name, cases in sorted(state.cases.items()):
+            print(f"{function_name}: {cases.occurrences()} errors, {len(cases)} distinct cases")
+        return
+
+    LocalDownloader = load_local_downloader()
+    bucket = DirectoryBucket(args.source_dir) if args.source_dir else None
+    worker = IngestWorker(LocalDownloader(bucket=bucket, output_dir=args.output_dir), lookback_days=args.lookback_days,
+                          retain_days=args.retain_days)
+    print(f"Resuming with {worker.state.batch_count} batches already ingested")
+
+    try:
+        if args.subscription:
+            try:
+                import google.cloud.pubsub_v1  # noqa: F401
+            except ImportError:
+                print("Error: --subscription requires google-cloud-pubsub, install it with `pip install google-cloud-pubsub`")
+                sys.exit(1)
+            worker.run_pubsub(args.subscription, once=args.once)
+        else:
+            worker.run_polling(args.interval, once=args.once)
+    except KeyboardInterrupt:
+        # Not saved, a batch may be half ingested. Anything since the last
+        # save is ingested again on the next run.
+        print("\nStopped, run again to resume.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,9 @@
 from datetime import datetime
-import json
 import sys
 
-iob_results = json.loads(sys.stdin.read())
+from records import iter_records
 
-for index, iob_result in enumerate(iob_results):
+for index, iob_result in enumerate(iter_records(sys.stdin.buffer)):
     result = iob_result["resultType"]
     created_at = iob_result["createdAt"]
     time = datetime.fromtimestamp(created_at)
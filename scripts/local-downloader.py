@@ -1,82 +1,385 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import os
-from datetime import datetime
-from google.cloud import storage
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+from download_manifest import DownloadManifest
+
 
 os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = 'google-auth.json'
 
+DEFAULT_WORKERS = 8
+DEFAULT_RETRIES = 3
+PROGRESS_INTERVAL_SECONDS = 5
+
+# Re-list this many days before the high-water mark to catch late uploads
+DEFAULT_LOOKBACK_DAYS = 2
+LISTING_QUEUE_SIZE = 1000
+LISTING_PUT_TIMEOUT_SECONDS = 0.1
+# {project}/algorithm-comparisons/{date}/{app_version}/{function}/{device_id}/{file}
+BATCH_PATH_SEGMENTS = 7
+
+
+def is_date(name: str) -> bool:
+    try:
+        datetime.strptime(name, "%Y-%m-%d")
+        return True
+    except ValueError:
+        return False
+
+
+def batch_suffix(blob) -> str:
+    """The name suffix a batch with `blob`'s Content-Encoding must have."""
+    return '.json.gz' if blob.content_encoding == 'gzip' else '.json'
+
+
+def has_batch_suffix(blob) -> bool:
+    """Check the suffix of an uploaded batch.
+
+    Upload grants let devices choose the file name, and GCS POST policies
+    cannot restrict a key's suffix, so it is checked here instead.
+    """
+    return blob.name.endswith(batch_suffix(blob))
+
+
+def has_batch_path(blob) -> bool:
+    """Check that a batch sits directly in its device's directory.
+
+    Upload grant file names may contain `/`, which would put objects deeper
+    than the readers of the downloaded files expect.
+    """
+    return len(blob.name.split('/')) == BATCH_PATH_SEGMENTS
+
+
 class LocalDownloader:
-    def __init__(self, bucket_name: str = "trio-oref-logs-gcs"):
+    def __init__(self, bucket_name: str = "trio-oref-logs-gcs", bucket=None, output_dir: str = 'downloaded_files'):
         self.bucket_name = bucket_name
-        self.storage_client = storage.Client()
-        self.bucket = self.storage_client.bucket(bucket_name)
-        self.tracking_file = 'downloaded_files/incremental_download.json'
-        self.output_dir = Path('downloaded_files')
+        if bucket is None:
+            from google.cloud import storage
+            self.storage_client = storage.Client()
+            self.bucket = self.storage_client.bucket(bucket_name)
+        else:
+            # A stand-in bucket (e.g. a local fake) for testing
+            self.storage_client = None
+            self.bucket = bucket
+        self.output_dir = Path(output_dir)
+        self.tracking_file = str(self.output_dir / 'incremental_download.jsonl')
+        self.listing_state_file = str(self.output_dir / 'listing_state.json')
         self.output_dir.mkdir(exist_ok=True)
         self.load_tracking_data()
 
     def load_tracking_data(self):
-        """Load or initialize the tracking data."""
-        if os.path.exists(self.tracking_file):
-            with open(self.tracking_file, 'r') as f:
-                self.processed_files = json.load(f)
-        else:
-            self.processed_files = {}
+        """Load the tracking manifest, migrating the old JSON file if present."""
+        self.manifest = DownloadManifest(self.tracking_file, legacy_path=self.output_dir / 'incremental_download.json')
 
     def save_tracking_data(self):
-        """Save the tracking data."""
-        with open(self.tracking_file, 'w') as f:
-            json.dump(self.processed_files, f, indent=4)
+        """Compact the tracking manifest and flush it to disk."""
+        self.manifest.compact()
 
     def should_process_file(self, blob) -> bool:
-        """Check if we should process this file based on its last update time."""
-        if blob.name not in self.processed_files:
+        """Check if we should process this file based on its name and last update time."""
+        if not has_batch_path(blob):
+            print(f"Skipping {blob.name}: not a {{project}}/algorithm-comparisons/{{date}}/{{version}}/{{function}}/{{device}}/{{file}} path")
+            return False
+        if not has_batch_suffix(blob):
+            print(f"Skipping {blob.name}: {blob.content_encoding or 'plain'} batches must end in {batch_suffix(blob)}")
+            return False
+        entry = self.manifest.get(blob.name)
+        if entry is None:
             return True
-        return blob.updated.isoformat() > self.processed_files[blob.name]
+        return blob.updated.isoformat() > entry['updated']
+
+    def load_high_water_mark(self, prefix: str):
+        """Return the newest date partition fully listed for `prefix`, if any."""
+        if not os.path.exists(self.listing_state_file):
+            return None
+        with open(self.listing_state_file, 'r') as f:
+            return json.load(f).get(prefix)
+
+    def save_high_water_mark(self, prefix: str, date: str):
+        state = {}
+        if os.path.exists(self.listing_state_file):
+            with open(self.listing_state_file, 'r') as f:
+                state = json.load(f)
+        state[prefix] = date
+        tmp_path = self.listing_state_file + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f, indent=4)
+        os.replace(tmp_path, self.listing_state_file)
+
+    def list_date_partitions(self, prefix: str):
+        """Return the sorted {date} partitions directly under `prefix`, skipping names that are not dates."""
+        iterator = self.bucket.list_blobs(prefix=prefix, delimiter='/')
+        # Prefixes are only populated as the pages are consumed
+        for _ in iterator:
+            pass
+        partitions = (partition[len(prefix):].rstrip('/') for partition in iterator.prefixes)
+        return sorted(partition for partition in partitions if is_date(partition))
+
+    def select_partitions(self, prefix: str, lookback_days: int):
+        """Pick the date partitions newer than the high-water mark minus the look-back."""
+        partitions = self.list_date_partitions(prefix)
+        high_water_mark = self.load_high_water_mark(prefix)
+        if high_water_mark is None or not is_date(high_water_mark):
+            return partitions
+        # A mark saved in the future by an older run would hide today's partitions
+        high_water_mark = min(high_water_mark, datetime.now(timezone.utc).strftime("%Y-%m-%d"))
+
+        cutoff = (datetime.strptime(high_water_mark, "%Y-%m-%d") - timedelta(days=lookback_days)).strftime("%Y-%m-%d")
+        return [partition for partition in partitions if partition >= cutoff]
+
+    def iter_partition_blobs(self, prefix: str, partitions, workers: int):
+        """Yield the blobs of several date partitions, listed concurrently.
+
+        Listing threads hand blobs over through a bounded queue, so the caller
+        can start downloading before all partitions have been listed.
+        """
+        if not partitions:
+            return
+
+        results = queue.Queue(maxsize=LISTING_QUEUE_SIZE)
+        done = object()
+        # Set when the caller stops early, so listing threads stop putting
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    results.put(item, timeout=LISTING_PUT_TIMEOUT_SECONDS)
+                    return
+                except queue.Full:
+                    pass
+
+        def list_partition(partition):
+            try:
+                for blob in self.bucket.list_blobs(prefix=f"{prefix}{partition}/"):
+                    if stop.is_set():
+                        return
+                    put(blob)
+            finally:
+                put(done)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(partitions)))) as executor:
+            futures = [executor.submit(list_partition, partition) for partition in partitions]
+            try:
+                remaining = len(futures)
+                while remaining:
+                    item = results.get()
+                    if item is done:
+                        remaining -= 1
+                    else:
+                        yield item
+            finally:
+                # On Ctrl-C, a download error or the generator being closed,
+                # unblock the listing threads so the executor can join them
+                stop.set()
+                while True:
+                    try:
+                        results.get_nowait()
+                    except queue.Empty:
+                        break
+
+            # Surface listing errors once every partition has finished
+            for future in futures:
+                future.result()
 
-    def download_incrementally(self, prefix: str = "trio-oref-validation/algorithm-comparisons/"):
-        """Download only new or updated files."""
+    def configure_http_pool(self, workers: int):
+        """Let the client's shared HTTP session keep one connection per worker."""
+        if self.storage_client is None:
+            return
+        from requests.adapters import HTTPAdapter
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.storage_client._http.mount("https://", adapter)
+
+    def local_path(self, blob) -> Path:
+        """Where `blob` is stored locally, matching its GCS path.
+
+        Gzip-encoded blobs always get a .gz suffix so readers can tell them apart.
+        """
+        local_path = self.output_dir / blob.name
+        if blob.content_encoding == 'gzip' and not blob.name.endswith('.gz'):
+            local_path = local_path.with_name(local_path.name + '.gz')
+        return local_path
+
+    def download_blob(self, blob, retries: int = DEFAULT_RETRIES):
+        """Download one blob, retrying with exponential backoff.
+
+        The file is written next to its final path and renamed into place,
+        so an interrupted run never leaves a truncated batch behind. Batches
+        uploaded with Content-Encoding: gzip are kept compressed, GCS would
+        otherwise decompress them in transit.
+        """
+        local_path = self.local_path(blob)
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        partial_path = local_path.with_name(local_path.name + '.part')
+        raw_download = blob.content_encoding == 'gzip'
+
+        for attempt in range(retries + 1):
+            try:
+                blob.download_to_filename(partial_path, raw_download=raw_download)
+                os.replace(partial_path, local_path)
+                return
+            except Exception as e:
+                if attempt == retries:
+                    raise
+                delay = (2 ** attempt) * 0.5 + random.uniform(0, 0.5)
+                print(f"Retrying {blob.name} in {delay:.1f}s after error: {e}")
+                time.sleep(delay)
+
+    def record_download(self, blob):
+        """Update tracking data after a blob has been downloaded."""
+        self.manifest.record(blob)
+
+    def download_incrementally(self, prefix: str = "trio-oref-validation/algorithm-comparisons/", workers: int = DEFAULT_WORKERS, retries: int = DEFAULT_RETRIES,
+                               partitioned: bool = False, lookback_days: int = DEFAULT_LOOKBACK_DAYS):
+        """Download only new or updated files.
+
+        With `partitioned`, only the date partitions from the stored
+        high-water mark (minus `lookback_days`) onwards are listed, and their
+        blobs are streamed into the downloads as they are listed.
+        """
         print(f"Starting incremental download from bucket: {self.bucket_name}")
         print(f"Using prefix: {prefix}")
-        
-        # List all blobs in the bucket with the given prefix
-        blobs = list(self.bucket.list_blobs(prefix=prefix))
-        print(f"Found {len(blobs)} total files")
-        
-        # Filter for files that need processing
-        blobs_to_process = [blob for blob in blobs if self.should_process_file(blob)]
-        print(f"Found {len(blobs_to_process)} files that need processing")
-        
-        processed_count = 0
-        for blob in blobs_to_process:
+
+        if partitioned:
+            partitions = self.select_partitions(prefix, lookback_days)
+            print(f"Listing {len(partitions)} date partitions" + (f" from {partitions[0]}" if partitions else ""))
+            blobs_to_process = (blob for blob in self.iter_partition_blobs(prefix, partitions, workers) if self.should_process_file(blob))
+            progress = DownloadProgress()
+        else:
+            # List all blobs in the bucket with the given prefix
+            blobs = list(self.bucket.list_blobs(prefix=prefix))
+            print(f"Found {len(blobs)} total files")
+
+            # Filter for files that need processing
+            blobs_to_process = [blob for blob in blobs if self.should_process_file(blob)]
+            print(f"Found {len(blobs_to_process)} files that need processing")
+            progress = DownloadProgress(len(blobs_to_process))
+
+        if workers <= 1:
+            for blob in blobs_to_process:
+                self._download_and_record(blob, retries, progress)
+        else:
+            self._download_concurrently(blobs_to_process, workers, retries, progress)
+        self.save_tracking_data()
+
+        # Only advance past partitions that downloaded cleanly
+        if partitioned and partitions and progress.errors == 0:
+            # Dates come from the devices' createdAt, so one far in the future
+            # must not move the mark past the days still receiving uploads
+            today = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+            self.save_high_water_mark(prefix, min(partitions[-1], today))
+
+        print(f"\nIncremental download complete. Downloaded {progress.downloaded} files.")
+        progress.report(final=True)
+
+    def _download_and_record(self, blob, retries, progress):
+        try:
+            self.download_blob(blob, retries)
+            self.record_download(blob)
+            progress.add(blob)
+            print(f"Downloaded: {blob.name}")
+        except Exception as e:
+            progress.add_error()
+            print(f"Error processing {blob.name}: {str(e)}")
+            import traceback
+            print(traceback.format_exc())
+
+    def _download_concurrently(self, blobs, workers, retries, progress):
+        """Download blobs with a bounded pool of threads sharing one HTTP session.
+
+        Only the calling thread touches the tracking data, so every completed
+        download is recorded exactly once and an interrupted run resumes where
+        it left off.
+        """
+        self.configure_http_pool(workers)
+        executor = ThreadPoolExecutor(max_workers=workers)
+        try:
+            # `blobs` may be a stream, so record results as they complete
+            # while it is still being consumed
+            pending = {}
+            for blob in blobs:
+                pending[executor.submit(self.download_blob, blob, retries)] = blob
+                if len(pending) >= workers * 4:
+                    self._record_completed(pending, progress)
+            while pending:
+                self._record_completed(pending, progress)
+        except KeyboardInterrupt:
+            print("\nInterrupted, finished downloads are recorded. Run again to resume.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.manifest.close()
+            raise
+        executor.shutdown()
+
+    def _record_completed(self, pending, progress):
+        """Wait for at least one download, record the finished ones and drop them from `pending`."""
+        finished = [future for future in pending if future.done()]
+        if not finished:
+            finished = [next(as_completed(pending))]
+
+        for future in finished:
+            blob = pending.pop(future)
             try:
-                # Create directory structure matching the GCS path
-                local_path = self.output_dir / blob.name
-                local_path.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Download the file
-                blob.download_to_filename(local_path)
-                
-                # Update tracking data
-                self.processed_files[blob.name] = blob.updated.isoformat()
-                self.save_tracking_data()
-                
-                processed_count += 1
-                print(f"Downloaded: {blob.name}")
-                
+                future.result()
             except Exception as e:
+                progress.add_error()
                 print(f"Error processing {blob.name}: {str(e)}")
-                import traceback
-                print(traceback.format_exc())
-        
-        print(f"\nIncremental download complete. Downloaded {processed_count} files.")
+                continue
+
+            self.record_download(blob)
+            progress.add(blob)
+            print(f"Downloaded: {blob.name}")
+
+
+class DownloadProgress:
+    """Counts downloads and prints throughput at most every few seconds."""
+
+    def __init__(self, total: int = None):
+        self.total = total
+        self.downloaded = 0
+        self.errors = 0
+        self.bytes = 0
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self._lock = threading.Lock()
+
+    def add(self, blob):
+        with self._lock:
+            self.downloaded += 1
+            self.bytes += blob.size or 0
+        self.report()
+
+    def add_error(self):
+        with self._lock:
+            self.errors += 1
+
+    def report(self, final: bool = False):
+        now = time.monotonic()
+        if not final and now - self.last_report < PROGRESS_INTERVAL_SECONDS:
+            return
+        self.last_report = now
+        elapsed = max(now - self.start, 1e-9)
+        total = f"/{self.total}" if self.total is not None else ""
+        print(f"Progress: {self.downloaded}{total} files, {self.errors} errors, "
+              f"{self.downloaded / elapsed:.1f} files/s, {self.bytes / elapsed / 1e6:.2f} MB/s")
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Incrementally download comparison logs from GCS.")
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="Number of concurrent downloads, 1 downloads sequentially")
+    parser.add_argument('--partitioned', action='store_true', help="Only list date partitions since the last run instead of the whole prefix")
+    parser.add_argument('--lookback-days', type=int, default=DEFAULT_LOOKBACK_DAYS, help="With --partitioned, days before the high-water mark to re-list for late uploads")
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES, help="Retries per file before giving up on it")
+    args = parser.parse_args()
+
     downloader = LocalDownloader()
-    downloader.download_incrementally()
+    downloader.download_incrementally(workers=args.workers, retries=args.retries, partitioned=args.partitioned, lookback_days=args.lookback_days)
 
 
 if __name__ == "__main__":
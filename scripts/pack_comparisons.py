@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+"""Pack the loose batch files of finished days into per-day archives.
+
+Each {date}/{function} partition becomes one compressed archive with a
+record-level index (see packed_archive.py), and the loose files are removed
+once they are safely packed. scan_errors.py, extract_day_errors.py,
+calculate_stats.py and comparison_index.py read packed batches like loose
+ones. The download manifest still lists packed blobs, so they are not
+downloaded again.
+
+    python scripts/pack_comparisons.py pack
+    python scripts/pack_comparisons.py pack --date 2025-06-20 --keep-loose
+    python scripts/pack_comparisons.py cat 2025-06-20/0.5.1/iob/DEVICE/BATCH.json --index 3
+"""
+
+import argparse
+import functools
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+from comparison_files import DOWNLOAD_DIR, PACKED_DIR, iter_loose_batches, iter_packed_batches
+from packed_archive import PackedPartition, iter_packed_records, read_packed_record
+from records import iter_records
+
+
+def _remove_loose(path, base_dir):
+    """Remove a packed file and the directories it leaves empty."""
+    os.remove(path)
+    directory = os.path.dirname(path)
+    while os.path.normpath(directory) != os.path.normpath(base_dir):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        directory = os.path.dirname(directory)
+
+
+def _packed_batches(batches, keep_loose, base_dir):
+    """Yield (entry, lines) for PackedPartition.append(), skipping files that do not decode."""
+    for batch in batches:
+        st = os.stat(batch.path)
+        try:
+            lines = [json.dumps(record, separators=(',', ':'), ensure_ascii=False).encode('utf-8') for record in iter_records(batch.path)]
+        except json.JSONDecodeError as e:
+            # Left loose, so every reader keeps warning about it
+            print(f"Warning: Not packing {batch.path}, could not decode JSON: {e}", file=sys.stderr)
+            continue
+        entry = {
+            'path': os.path.relpath(batch.path, base_dir).replace(os.sep, '/'),
+            'app_version': batch.app_version,
+            'device_id': batch.device_id,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+        }
+        if not keep_loose:
+            entry['on_packed'] = functools.partial(_remove_loose, batch.path, base_dir)
+        yield entry, lines
+
+
+def pack(dates, keep_loose=False, base_dir=DOWNLOAD_DIR, packed_dir=PACKED_DIR):
+    """Append the loose batches of `dates` to their archives, return {(date, function): batches packed}."""
+    counts = {}
+    for date in dates:
+        partitions = {}
+        for batch in iter_loose_batches([date], base_dir=base_dir):
+            partitions.setdefault(batch.function, []).append(batch)
+        for function_name, batches in sorted(partitions.items()):
+            partition = PackedPartition(date, function_name, packed_dir)
+            counts[(date, function_name)] = partition.append(_packed_batches(batches, keep_loose, base_dir))
+    return counts
+
+
+def _loose_dates(base_dir):
+    try:
+        return sorted(entry.name for entry in os.scandir(base_dir) if entry.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack downloaded comparison batches into per-day archives.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = subparsers.add_parser('pack', help="Pack the loose batches of finished days")
+    pack_parser.add_argument('--date', action='append', help="Pack this day, may be repeated, default every day before --before")
+    pack_parser.add_argument('--before', default=datetime.now(timezone.utc).strftime("%Y-%m-%d"),
+                             help="Only pack days before this one, default today (UTC) as it still receives uploads")
+    pack_parser.add_argument('--keep-loose', action='store_true', help="Keep the loose files after packing them")
+
+    cat_parser = subparsers.add_parser('cat', help="Print a packed batch, or one of its records")
+    cat_parser.add_argument('path', help="Batch path relative to the download directory, {date}/{version}/{function}/{device}/{file}")
+    cat_parser.add_argument('--index', type=int, help="Only print this record")
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        dates = args.date or [date for date in _loose_dates(DOWNLOAD_DIR) if date < args.before]
+        counts = pack(dates, keep_loose=args.keep_loose)
+        for (date, function_name), count in counts.items():
+            if count:
+                print(f"Packed {count} batches into {date}/{function_name}")
+        print(f"Packed {sum(counts.values())} batches from {len(dates)} days")
+        return
+
+    parts = args.path.split('/')
+    if len(parts) != 5:
+        parser.error("path must be {date}/{version}/{function}/{device}/{file}")
+    path = os.path.join(DOWNLOAD_DIR, *parts)
+    batch = next((batch for batch in iter_packed_batches(parts[0], functions=[parts[2]]) if batch.path == path), None)
+    if batch is None:
+        print(f"{args.path} is not packed", file=sys.stderr)
+        sys.exit(1)
+    if args.index is not None:
+        if not 0 <= args.index < len(batch.packed.spans):
+            parser.error(f"{args.path} has {len(batch.packed.spans)} records")
+        json.dump(read_packed_record(batch.packed, args.index), sys.stdout, indent=4, sort_keys=True)
+    else:
+        json.dump(list(iter_packed_records(batch.packed)), sys.stdout, indent=4)
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Packed per-day archives of downloaded comparison batches.
+
+Packing moves the loose batch files of each {date}/{function} partition into
+two files under {packed_dir}/{date}/:
+
+    {function}.pack         gzip members, each a block of batches with one
+                            compact JSON record per line
+    {function}.index.jsonl  one line per batch with its original path,
+                            app version, device, the byte range of its block
+                            in the pack and the span of each record in the
+                            decompressed block
+
+Both files are only ever appended to. Pack data is synced before the index
+lines that refer to it, so an interrupted run leaves at most unreferenced
+bytes, which the next append overwrites. A batch packed again (e.g. because
+it was downloaded again) supersedes its earlier entry.
+
+Reading a batch decompresses one block, and a single record is sliced out
+of it by its span, so readers never scan more than one block.
+pack_comparisons.py builds the archives, comparison_files.py lists packed
+batches alongside loose ones.
+"""
+
+import functools
+import json
+import os
+import zlib
+from typing import NamedTuple
+
+# Uncompressed bytes per gzip member, large enough to compress well and
+# small enough that fetching one record stays cheap
+BLOCK_SIZE = 1 << 20
+
+
+class PackedBatch(NamedTuple):
+    """Where a packed batch's records are, plain data so it pickles to workers."""
+    pack_path: str
+    block_offset: int
+    block_length: int
+    spans: tuple
+
+
+@functools.lru_cache(maxsize=4)
+def _read_block(pack_path, offset, length):
+    with open(pack_path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    if len(data) != length:
+        raise json.JSONDecodeError("Packed block is past the end of the archive", '', 0)
+    try:
+        return zlib.decompress(data, 31)
+    except zlib.error as e:
+        raise json.JSONDecodeError(f"Corrupt packed block: {e}", '', 0) from e
+
+
+def iter_packed_records(batch):
+    """Yield the records of a PackedBatch."""
+    block = _read_block(batch.pack_path, batch.block_offset, batch.block_length)
+    for offset, length in batch.spans:
+        yield json.loads(block[offset:offset + length])
+
+
+def read_packed_record(batch, index):
+    """Return record `index` of a PackedBatch."""
+    offset, length = batch.spans[index]
+    return json.loads(_read_block(batch.pack_path, batch.block_offset, batch.block_length)[offset:offset + length])
+
+
+INDEX_SUFFIX = '.index.jsonl'
+
+
+def packed_dates(packed_dir):
+    """The days that have packed archives."""
+    try:
+        return sorted(entry.name for entry in os.scandir(packed_dir) if entry.is_dir())
+    except FileNotFoundError:
+        return []
+
+
+def packed_functions(date, packed_dir):
+    """The functions of `date` that have a packed archive."""
+    try:
+        return sorted(entry.name[:-len(INDEX_SUFFIX)] for entry in os.scandir(os.path.join(packed_dir, date))
+                      if entry.name.endswith(INDEX_SUFFIX))
+    except FileNotFoundError:
+        return []
+
+
+class PackedPartition:
+    """The archive of one {date}/{function} partition."""
+
+    def __init__(self, date, function_name, packed_dir):
+        self.date = date
+        self.function = function_name
+        self.pack_path = os.path.join(packed_dir, date, f"{function_name}.pack")
+        self.index_path = os.path.join(packed_dir, date, function_name + INDEX_SUFFIX)
+
+    def exists(self):
+        return os.path.exists(self.index_path)
+
+    def _read_index(self):
+        """Return (entries by path, index bytes to keep, pack bytes to keep)."""
+        entries = {}
+        index_end = 0
+        pack_end = 0
+        if not self.exists():
+            return entries, index_end, pack_end
+
+        pack_size = os.path.getsize(self.pack_path) if os.path.exists(self.pack_path) else 0
+        with open(self.index_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A partial trailing line from an interrupted append
+                    break
+                entry = json.loads(line)
+                if entry['offset'] + entry['length'] > pack_size:
+                    break
+                index_end += len(line)
+                pack_end = max(pack_end, entry['offset'] + entry['length'])
+                entries[entry['path']] = entry
+        return entries, index_end, pack_end
+
+    def entries(self):
+        """Return the current entry for each packed batch path, in path order."""
+        entries, _, _ = self._read_index()
+        return [entries[path] for path in sorted(entries)]
+
+    def batch(self, entry):
+        return PackedBatch(self.pack_path, entry['offset'], entry['length'], tuple(tuple(span) for span in entry['spans']))
+
+    def append(self, batches):
+        """Append batches as new blocks.
+
+        `batches` yields (entry, lines) where entry has path, app_version,
+        device_id, size and mtime_ns, and lines are the encoded records. The
+        callback `entry['on_packed']`, if present, runs once the batch's
+        block and index line are durable. Returns the number of batches
+        appended.
+        """
+        _, index_end, pack_end = self._read_index()
+        os.makedirs(os.path.dirname(self.pack_path), exist_ok=True)
+        with open(self.pack_path, 'ab'), open(self.index_path, 'ab'):
+            pass
+
+        with open(self.pack_path, 'r+b') as pack, open(self.index_path, 'r+b') as index:
+            # Drop anything left over from an interrupted run
+            pack.truncate(pack_end)
+            index.truncate(index_end)
+            pack.seek(pack_end)
+            index.seek(index_end)
+
+            block = []
+            block_size = 0
+            pending = []
+            count = 0
+            for entry, lines in batches:
+                count += 1
+                spans = []
+                for line in lines:
+                    spans.append([block_size, len(line)])
+                    block.append(line)
+                    block.append(b'\n')
+                    block_size += len(line) + 1
+                pending.append((entry, spans))
+                if block_size >= BLOCK_SIZE:
+                    self._write_block(pack, index, block, pending)
+                    block = []
+                    block_size = 0
+                    pending = []
+            if pending:
+                self._write_block(pack, index, block, pending)
+        return count
+
+    def _write_block(self, pack, index, block, pending):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        data = compressor.compress(b''.join(block)) + compressor.flush()
+        offset = pack.tell()
+        pack.write(data)
+        pack.flush()
+        os.fsync(pack.fileno())
+
+        lines = []
+        for entry, spans in pending:
+            record = {key: entry[key] for key in ('path', 'app_version', 'device_id', 'size', 'mtime_ns')}
+            record.update({'offset': offset, 'length': len(data), 'spans': spans})
+            lines.append(json.dumps(record, separators=(',', ':')) + '\n')
+        index.write(''.join(lines).encode('utf-8'))
+        index.flush()
+        os.fsync(index.fileno())
+
+        for entry, _ in pending:
+            if entry.get('on_packed'):
+                entry['on_packed']()
@@ -0,0 +1,326 @@
+"""Streaming reader for comparison batch files.
+
+Batch files are a top-level JSON array of records. iter_records() memory-maps
+the file (or reads it in chunks when it cannot be mapped, e.g. stdin) and
+yields one array element at a time, so peak memory is bounded by the largest
+record rather than the whole batch. A file holding a single top-level object
+yields that object.
+
+If ijson is installed its C backend is used for arrays; otherwise the
+standard library decoder parses each element out of a sliding window.
+When ijson fails, e.g. on integers beyond 64 bits that json.load accepts,
+the rest of the file is decoded with the standard library instead.
+Decoding errors are raised as json.JSONDecodeError with either backend.
+
+iter_record_spans() also reports where each record sits in the file, so an
+index can later fetch a single record with read_record_at().
+
+Gzipped batches (uploaded with Content-Encoding: gzip) are recognized by
+their magic bytes and decompressed as they are streamed. Their spans are
+offsets into the decompressed data.
+"""
+
+import codecs
+import gzip
+import io
+import itertools
+import json
+import mmap
+import os
+import zlib
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+CHUNK_SIZE = 1 << 20
+GZIP_MAGIC = b'\x1f\x8b'
+# Raised for corrupt or truncated gzip data, reported as decoding errors
+GZIP_ERRORS = (OSError, EOFError, zlib.error)
+WHITESPACE = ' \t\n\r'
+
+
+def iter_records(source, backend='auto'):
+    """Yield the records in `source`, a path or a binary file object.
+
+    `backend` is 'auto' (ijson if available), 'ijson' or 'python'.
+    """
+    if backend == 'ijson' and ijson is None:
+        raise ValueError("The ijson backend was requested but ijson is not installed")
+    use_ijson = ijson is not None and backend in ('auto', 'ijson')
+
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from _iter_file(f, use_ijson)
+    else:
+        yield from _iter_file(source, use_ijson)
+
+
+def iter_record_spans(source):
+    """Yield (offset, length, record) for the records in `source`.
+
+    `offset` and `length` are the byte range of the record's JSON text. Spans
+    need byte positions, so this always uses the standard library decoder.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield from _iter_file_spans(f)
+    else:
+        yield from _iter_file_spans(source)
+
+
+def read_record_at(source, offset, length):
+    """Decode the single record at a span reported by iter_record_spans()."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            return read_record_at(f, offset, length)
+    if _is_gzip(source):
+        # Seeking decompresses everything before `offset`
+        stream = gzip.GzipFile(fileobj=source, mode='rb')
+        try:
+            stream.seek(offset)
+            data = stream.read(length)
+        except GZIP_ERRORS as e:
+            raise json.JSONDecodeError(f"Corrupt gzip data: {e}", '', 0) from e
+    else:
+        source.seek(offset)
+        data = source.read(length)
+    if len(data) != length:
+        raise json.JSONDecodeError("Record span is past the end of the file", '', 0)
+    return json.loads(data)
+
+
+def _iter_file_spans(f):
+    if _is_gzip(f):
+        yield from _iter_spans(_gunzip_chunks(f))
+        return
+
+    mapped = _map(f)
+    if mapped is None:
+        yield from _iter_spans(_chunks(f))
+        return
+
+    try:
+        yield from _iter_spans(_mapped_chunks(mapped))
+    finally:
+        mapped.close()
+
+
+def _iter_file(f, use_ijson):
+    if _is_gzip(f):
+        stream = gzip.GzipFile(fileobj=f, mode='rb')
+        try:
+            is_array = stream.peek(64)[:64].lstrip()[:1] == b'['
+        except GZIP_ERRORS as e:
+            raise json.JSONDecodeError(f"Corrupt gzip data: {e}", '', 0) from e
+        if use_ijson and is_array:
+            def restart():
+                f.seek(0)
+                return _gunzip_chunks(f)
+            try:
+                yield from _iter_ijson_or_python(stream, restart if f.seekable() else None)
+            except GZIP_ERRORS as e:
+                raise json.JSONDecodeError(f"Corrupt gzip data: {e}", '', 0) from e
+        else:
+            yield from _iter_python(_gunzip_chunks(f, stream))
+        return
+
+    mapped = _map(f)
+    if mapped is None:
+        yield from _iter_python(_chunks(f))
+        return
+
+    try:
+        if use_ijson and mapped[:64].lstrip()[:1] == b'[':
+            yield from _iter_ijson_or_python(mapped, lambda: _mapped_chunks(mapped))
+        else:
+            yield from _iter_python(_mapped_chunks(mapped))
+    finally:
+        mapped.close()
+
+
+def _is_gzip(f):
+    """Check for the gzip magic bytes without consuming them."""
+    if hasattr(f, 'peek'):
+        return f.peek(2)[:2] == GZIP_MAGIC
+    try:
+        position = f.tell()
+        head = f.read(2)
+        f.seek(position)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return False
+    return head == GZIP_MAGIC
+
+
+def _map(f):
+    """Memory-map a regular file, or return None if it cannot be mapped."""
+    try:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        return None
+
+
+def _chunks(f):
+    while True:
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def _mapped_chunks(mapped):
+    return (mapped[i:i + CHUNK_SIZE] for i in range(0, len(mapped), CHUNK_SIZE))
+
+
+def _gunzip_chunks(f, stream=None):
+    """Decompressed chunks of a gzip file, with gzip errors as decoding errors."""
+    stream = stream or gzip.GzipFile(fileobj=f, mode='rb')
+    try:
+        yield from _chunks(stream)
+    except GZIP_ERRORS as e:
+        raise json.JSONDecodeError(f"Corrupt gzip data: {e}", '', 0) from e
+
+
+def _iter_ijson(stream):
+    try:
+        yield from ijson.items(stream, 'item', use_float=True)
+    except ijson.JSONError as e:
+        raise json.JSONDecodeError(str(e), '', 0) from e
+
+
+def _iter_ijson_or_python(stream, restart):
+    """ijson's records, falling back to the standard library if ijson fails.
+
+    `restart()` returns the file's chunks from the start, None if the file
+    can't be reread. Records ijson already yielded are skipped, and if the
+    standard library fails too its error is raised.
+    """
+    count = 0
+    try:
+        for record in _iter_ijson(stream):
+            count += 1
+            yield record
+    except json.JSONDecodeError:
+        if restart is None:
+            raise
+        yield from itertools.islice(_iter_python(restart()), count, None)
+
+
+class _Window:
+    """A decoded text window over a stream of byte chunks."""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+        # Byte offset in the stream of text[0], and a (position, offset)
+        # mark so record spans are measured incrementally
+        self.base = 0
+        self.mark = (0, 0)
+
+    def fill(self):
+        """Drop consumed text and append the next chunk, return False at EOF."""
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            tail = self.decoder.decode(b'', final=True)
+        else:
+            tail = self.decoder.decode(chunk)
+        self.base = self.offset_of(self.pos)
+        self.mark = (0, self.base)
+        self.text = self.text[self.pos:] + tail
+        self.pos = 0
+        return True
+
+    def offset_of(self, pos):
+        """Byte offset in the stream of text[pos], pos must not precede the last call."""
+        mark_pos, mark_offset = self.mark
+        offset = mark_offset + self.byte_length(mark_pos, pos)
+        self.mark = (pos, offset)
+        return offset
+
+    def byte_length(self, start, end):
+        """UTF-8 length of text[start:end]."""
+        segment = self.text[start:end]
+        return len(segment) if segment.isascii() else len(segment.encode('utf-8'))
+
+    def peek(self):
+        """Skip whitespace and return the next character, or '' at EOF."""
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+
+def _iter_python(chunks):
+    for _, _, value in _iter_spans(chunks):
+        yield value
+
+
+def _iter_spans(chunks):
+    decoder = json.JSONDecoder()
+    window = _Window(chunks)
+
+    first = window.peek()
+    if first != '[':
+        # Not an array, decode the whole document as a single record
+        while window.fill():
+            pass
+        text = window.text[window.pos:]
+        value = decoder.decode(text)
+        stripped = text.rstrip(WHITESPACE)
+        yield window.offset_of(window.pos), window.byte_length(window.pos, window.pos + len(stripped)), value
+        return
+
+    window.pos += 1
+    if window.peek() == ']':
+        window.pos += 1
+        _expect_end(window)
+        return
+
+    while True:
+        window.peek()
+        while True:
+            try:
+                value, end = decoder.raw_decode(window.text, window.pos)
+            except json.JSONDecodeError:
+                # Most likely the element continues in the next chunk
+                if window.fill():
+                    continue
+                raise
+            following = end
+            while following < len(window.text) and window.text[following] in WHITESPACE:
+                following += 1
+            if (following == len(window.text) or window.text[following] not in ',]') and window.fill():
+                # A scalar cut at the chunk boundary (e.g. "1.5e|3") could still grow
+                continue
+            break
+
+        offset = window.offset_of(window.pos)
+        yield offset, window.offset_of(end) - offset, value
+        window.pos = end
+
+        separator = window.peek()
+        if separator == ',':
+            window.pos += 1
+        elif separator == ']':
+            window.pos += 1
+            _expect_end(window)
+            return
+        else:
+            raise json.JSONDecodeError("Expecting ',' delimiter", window.text, window.pos)
+
+
+def _expect_end(window):
+    if window.peek() != '':
+        raise json.JSONDecodeError("Extra data", window.text, window.pos)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Count non-matching comparison records per function for a day or range of days.
+
+Scans every app version in one process (or a pool of them with --workers)
+instead of starting Python once per batch file.
+"""
+
+import argparse
+import json
+import multiprocessing
+import sys
+from collections import Counter
+from datetime import datetime
+
+from comparison_files import FUNCTIONS, date_range, iter_batch_files, iter_batch_records
+
+
+def scan_file(batch):
+    """Return (function, error count, error lines) for one batch file."""
+    path, function_name = batch.path, batch.function
+    count = 0
+    lines = []
+    try:
+        for index, record in enumerate(iter_batch_records(batch)):
+            try:
+                result = record["resultType"]
+                if result != "matching":
+                    created_at = record["createdAt"]
+                    time = datetime.fromtimestamp(created_at)
+                    lines.append(f"{function_name}[{created_at}]: {result} @ {time.strftime('%A, %B %d, %Y at %I:%M %p')} in {path}")
+                    count += 1
+            except (KeyError, TypeError, ValueError, OverflowError, OSError) as e:
+                # One malformed record must not abort the whole scan
+                print(f"Warning: Skipping malformed record {index} in {path}: {e!r}", file=sys.stderr)
+    except json.JSONDecodeError as e:
+        # Errors before the bad JSON still count, as they did with list_errors.py
+        print(f"Warning: Could not decode JSON from {path}: {e}", file=sys.stderr)
+    return function_name, count, lines
+
+
+def scan(dates, functions=FUNCTIONS, versions=None, workers=1):
+    """Yield scan_file() results in batch file order."""
+    batches = list(iter_batch_files(dates, functions=functions, versions=versions))
+    if workers == 1 or len(batches) < 2:
+        yield from map(scan_file, batches)
+        return
+
+    with multiprocessing.Pool(workers) as pool:
+        chunksize = max(1, len(batches) // ((workers or multiprocessing.cpu_count()) * 8))
+        yield from pool.imap(scan_file, batches, chunksize=chunksize)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count comparison errors per function across all app versions.")
+    parser.add_argument('date', help="YYYY-MM-DD, the first day with --until")
+    parser.add_argument('--until', help="Last day (inclusive) of a date range")
+    parser.add_argument('--function', action='append', choices=FUNCTIONS, help="Only scan this function, may be repeated")
+    parser.add_argument('--version', action='append', help="Only scan this app version, may be repeated")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes, 0 uses every CPU")
+    parser.add_argument('--list', action='store_true', help="Also print each error")
+    args = parser.parse_args()
+
+    try:
+        dates = date_range(args.date, args.until)
+    except ValueError:
+        parser.error("dates must be YYYY-MM-DD")
+    functions = args.function or FUNCTIONS
+
+    counts = Counter()
+    for function_name, count, lines in scan(dates, functions=functions, versions=args.version, workers=args.workers or None):
+        counts[function_name] += count
+        if args.list:
+            for line in lines:
+                print(line)
+
+    for function_name in functions:
+        print(f"Checking {function_name}")
+        print(f"Found {counts[function_name]} errors for {function_name}")
+
+
+if __name__ == "__main__":
+    main()
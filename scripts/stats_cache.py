@@ -0,0 +1,69 @@
+import os
+import pickle
+
+
+class StatsCache:
+    """Persistent per-file partial statistics keyed by path, size and mtime.
+
+    The whole cache is dropped when `version` changes, so callers should
+    derive it from the code that builds the partials. Entries for files
+    that were not used in a run are evicted when the cache is saved.
+    """
+
+    def __init__(self, path, version, base_dir):
+        self.path = path
+        self.version = version
+        self.base_dir = base_dir
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                cached = pickle.load(f)
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+            print(f"Warning: Ignoring unreadable stats cache {self.path}: {e}")
+            return
+        if cached.get('version') == self.version:
+            self.entries = cached['entries']
+        else:
+            print("Stats cache was built by different aggregation code, rebuilding it.")
+
+    def _key(self, filepath):
+        return os.path.relpath(filepath, self.base_dir)
+
+    def get(self, filepath, require=(), identity=None):
+        """Return (partial, identity) where partial is None on a miss.
+
+        A cached partial lacking any of the keys in `require` is a miss.
+        `identity` defaults to the file's size and mtime, callers pass their
+        own for files that are not on disk as such. The returned identity
+        must be passed back to put() so that a file modified while it was
+        being parsed is not cached under its new size and mtime.
+        """
+        if identity is None:
+            st = os.stat(filepath)
+            identity = (st.st_size, st.st_mtime_ns)
+        entry = self.entries.get(self._key(filepath))
+        if entry is not None and entry[0] == identity and all(key in entry[1] for key in require):
+            self.hits += 1
+            return entry[1], identity
+        self.misses += 1
+        return None, identity
+
+    def put(self, filepath, identity, partial):
+        self.entries[self._key(filepath)] = (identity, partial)
+
+    def save(self, used_paths):
+        """Evict entries for files outside `used_paths` and write the cache atomically."""
+        used_keys = {self._key(filepath) for filepath in used_paths}
+        self.entries = {key: entry for key, entry in self.entries.items() if key in used_keys}
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': self.version, 'entries': self.entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,207 @@
+"""Columnar store and vectorized analysis of paired JS/Swift timings.
+
+TimingColumns keeps one row per timed comparison in compact typed arrays per
+function, with app version, device and day stored as small integer codes.
+Unlike the duration summaries it keeps the pairing between the JS and Swift
+duration of the same record, so per-record speedups can be computed.
+
+Collecting only needs the standard library; analyze() needs NumPy.
+"""
+
+from array import array
+import re
+
+
+REGRESSION_THRESHOLD = 0.05
+TOP_DEVICES = 10
+
+
+class _StringCodes:
+    """Maps strings to dense integer codes."""
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class _FunctionColumns:
+    def __init__(self):
+        self.js = array('d')
+        self.swift = array('d')
+        self.version = array('H')
+        self.device = array('I')
+        self.day = array('H')
+        self.matching = array('b')
+
+
+class TimingColumns:
+    """Per-function typed columns of (js, swift, version, device, day, matching)."""
+
+    def __init__(self):
+        self.functions = {}
+        self.versions = _StringCodes()
+        self.devices = _StringCodes()
+        self.days = _StringCodes()
+
+    def __len__(self):
+        return sum(len(columns.js) for columns in self.functions.values())
+
+    def add(self, function_name, js_duration, swift_duration, app_version, device_id, day_str, matching):
+        columns = self.functions.get(function_name)
+        if columns is None:
+            columns = self.functions[function_name] = _FunctionColumns()
+        columns.js.append(js_duration)
+        columns.swift.append(swift_duration)
+        columns.version.append(self.versions.code(app_version))
+        columns.device.append(self.devices.code(device_id))
+        columns.day.append(self.days.code(day_str))
+        columns.matching.append(1 if matching else 0)
+
+    def merge(self, other):
+        """Append another TimingColumns, translating its string codes into ours."""
+        version_map = [self.versions.code(value) for value in other.versions.values]
+        device_map = [self.devices.code(value) for value in other.devices.values]
+        day_map = [self.days.code(value) for value in other.days.values]
+
+        for function_name, theirs in other.functions.items():
+            ours = self.functions.get(function_name)
+            if ours is None:
+                ours = self.functions[function_name] = _FunctionColumns()
+            ours.js.extend(theirs.js)
+            ours.swift.extend(theirs.swift)
+            ours.version.extend(version_map[code] for code in theirs.version)
+            ours.device.extend(device_map[code] for code in theirs.device)
+            ours.day.extend(day_map[code] for code in theirs.day)
+            ours.matching.extend(theirs.matching)
+        return self
+
+
+def version_key(version):
+    """Sort key that orders '0.10.0' after '0.9.1'."""
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in re.split(r'[.\-+]', version)]
+
+
+def _group_summaries(np, codes, speedup, js, swift, matching, labels):
+    """Summarize rows grouped by integer code, returned as {label: summary}."""
+    order = np.argsort(codes, kind='stable')
+    sorted_codes = codes[order]
+    unique, starts = np.unique(sorted_codes, return_index=True)
+    ends = np.append(starts[1:], len(sorted_codes))
+
+    groups = {}
+    for code, start, end in zip(unique, starts, ends):
+        rows = order[start:end]
+        groups[labels[code]] = {
+            'count': int(end - start),
+            'median_js': float(np.median(js[rows])),
+            'median_swift': float(np.median(swift[rows])),
+            'median_speedup': float(np.median(speedup[rows])),
+            'mismatch_rate': float(1 - matching[rows].mean()),
+        }
+    return groups
+
+
+def analyze(columns, regression_threshold=REGRESSION_THRESHOLD):
+    """Compute speedup distributions, breakdowns and version regressions per function.
+
+    Speedup is js_duration / swift_duration per record, so values above 1
+    mean Swift was faster on that record.
+    """
+    import numpy as np
+
+    results = {}
+    for function_name, function_columns in columns.functions.items():
+        js = np.frombuffer(function_columns.js, dtype=np.float64)
+        swift = np.frombuffer(function_columns.swift, dtype=np.float64)
+        valid = (js > 0) & (swift > 0)
+        if not valid.any():
+            continue
+
+        js = js[valid]
+        swift = swift[valid]
+        version = np.frombuffer(function_columns.version, dtype=np.uint16)[valid]
+        device = np.frombuffer(function_columns.device, dtype=np.uint32)[valid]
+        day = np.frombuffer(function_columns.day, dtype=np.uint16)[valid]
+        matching = np.frombuffer(function_columns.matching, dtype=np.int8)[valid].astype(np.float64)
+        speedup = js / swift
+
+        p10, p50, p90, p99 = np.percentile(speedup, [10, 50, 90, 99])
+        summary = {
+            'count': int(len(speedup)),
+            'geomean_speedup': float(np.exp(np.log(speedup).mean())),
+            'speedup_p10': float(p10),
+            'speedup_p50': float(p50),
+            'speedup_p90': float(p90),
+            'speedup_p99': float(p99),
+            'swift_faster_fraction': float((swift < js).mean()),
+        }
+
+        by_version = _group_summaries(np, version, speedup, js, swift, matching, columns.versions.values)
+        by_device = _group_summaries(np, device, speedup, js, swift, matching, columns.devices.values)
+        by_day = _group_summaries(np, day, speedup, js, swift, matching, columns.days.values)
+
+        # Compare each version with the previous one in version order
+        regressions = []
+        ordered_versions = sorted(by_version, key=version_key)
+        for previous, current in zip(ordered_versions, ordered_versions[1:]):
+            before = by_version[previous]
+            after = by_version[current]
+            swift_change = after['median_swift'] / before['median_swift'] - 1
+            speedup_change = after['median_speedup'] / before['median_speedup'] - 1
+            if swift_change > regression_threshold or speedup_change < -regression_threshold:
+                regressions.append({
+                    'from': previous,
+                    'to': current,
+                    'median_swift_change': swift_change,
+                    'median_speedup_change': speedup_change,
+                })
+
+        results[function_name] = {
+            'summary': summary,
+            'by_version': {version_label: by_version[version_label] for version_label in ordered_versions},
+            'by_device': dict(sorted(by_device.items(), key=lambda item: -item[1]['count'])),
+            'by_day': dict(sorted(by_day.items())),
+            'regressions': regressions,
+        }
+    return results
+
+
+def print_analysis(results, top_devices=TOP_DEVICES):
+    """Print the output of analyze() in the style of the statistics report."""
+    print("--- JS vs Swift Timing Analysis (speedup = JS / Swift) ---")
+    for function_name, result in results.items():
+        summary = result['summary']
+        print(f"\n{function_name} ({summary['count']} timed comparisons):")
+        print(f"  Geometric Mean Speedup: {summary['geomean_speedup']:.3f}")
+        print(f"  Speedup p10/p50/p90/p99: {summary['speedup_p10']:.3f} / {summary['speedup_p50']:.3f} / "
+              f"{summary['speedup_p90']:.3f} / {summary['speedup_p99']:.3f}")
+        print(f"  Swift Faster On: {summary['swift_faster_fraction']:.1%} of records")
+
+        print("  By App Version:")
+        for label, group in result['by_version'].items():
+            print(f"    {label}: n={group['count']} median JS {group['median_js']:.4f}, "
+                  f"median Swift {group['median_swift']:.4f}, median speedup {group['median_speedup']:.3f}, "
+                  f"mismatches {group['mismatch_rate']:.2%}")
+
+        print(f"  By Device (top {top_devices} by count):")
+        for label, group in list(result['by_device'].items())[:top_devices]:
+            print(f"    {label}: n={group['count']} median speedup {group['median_speedup']:.3f}, "
+                  f"mismatches {group['mismatch_rate']:.2%}")
+
+        print("  By Day:")
+        for label, group in result['by_day'].items():
+            print(f"    {label}: n={group['count']} median speedup {group['median_speedup']:.3f}")
+
+        for regression in result['regressions']:
+            print(f"  REGRESSION {regression['from']} -> {regression['to']}: "
+                  f"median Swift {regression['median_swift_change']:+.1%}, "
+                  f"median speedup {regression['median_speedup_change']:+.1%}")
+
+    print("------------------------\n")
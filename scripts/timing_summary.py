@@ -0,0 +1,80 @@
+import math
+
+
+# Quantiles are within 1% of the true value, which keeps the sketch to a few
+# hundred bins for durations between microseconds and minutes
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+LOG_GAMMA = math.log(GAMMA)
+
+
+class DurationSummary:
+    """Fixed-size, mergeable summary of a stream of durations.
+
+    Keeps count, sum, min and max exactly and the distribution as a
+    DDSketch: values are counted in logarithmic bins, so any quantile is
+    reported within RELATIVE_ACCURACY of the true value. Summaries built
+    from separate files or processes merge by adding their bins.
+    """
+
+    __slots__ = ('count', 'total', 'min', 'max', 'zero_count', 'bins')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.zero_count = 0
+        self.bins = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / LOG_GAMMA)
+            self.bins[key] = self.bins.get(key, 0) + 1
+
+    def merge(self, other):
+        if not other.count:
+            return self
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.zero_count += other.zero_count
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        return self
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q):
+        """Return the approximate q-quantile (0 <= q <= 1), or None if empty."""
+        if not self.count:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if seen > rank:
+            return max(self.min, 0.0)
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                value = 2 * GAMMA ** key / (GAMMA + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def __getstate__(self):
+        return (self.count, self.total, self.min, self.max, self.zero_count, self.bins)
+
+    def __setstate__(self, state):
+        self.count, self.total, self.min, self.max, self.zero_count, self.bins = state
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+"""Upload one small batch through /v1/upload-grant to check it end to end.
+
+Asks the service for a grant, POSTs a one-record batch to GCS with the
+returned fields like a device would, and prints GCS's response. Run it
+against a deployed service (or main.py with real credentials) after
+changing how grants are signed. The batch lands in the bucket under a
+TRY-UPLOAD device ID, so it shows up in the next download.
+
+    python scripts/try_upload_grant.py https://trio-oref-logs.uc.r.appspot.com
+    python scripts/try_upload_grant.py http://127.0.0.1:5001 --gzip
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+import uuid
+
+import requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload one test batch with an upload grant.")
+    parser.add_argument('service', help="Base URL of the signed-URL service")
+    parser.add_argument('--function', default='iob', help="Function to upload the batch for")
+    parser.add_argument('--gzip', action='store_true', help="Ask for a gzip grant and upload a .json.gz batch")
+    args = parser.parse_args()
+
+    request = {
+        "project": "trio-oref-validation",
+        "deviceId": "TRY-UPLOAD",
+        "appVersion": "0.0.0",
+        "function": args.function,
+        "createdAt": time.time(),
+    }
+    if args.gzip:
+        request["contentEncoding"] = "gzip"
+    response = requests.post(f"{args.service.rstrip('/')}/v1/upload-grant", json=request, timeout=30)
+    response.raise_for_status()
+    grant = response.json()
+
+    body = json.dumps([{"resultType": "matching", "createdAt": request["createdAt"], "isSimulator": True}]).encode('utf-8')
+    filename = f"{uuid.uuid4()}.json"
+    if args.gzip:
+        body = gzip.compress(body)
+        filename += ".gz"
+    upload = requests.post(grant["url"], data=grant["fields"], files={"file": (filename, body, "application/json")}, timeout=30)
+
+    print(f"{upload.status_code} for {grant['prefix']}{filename}")
+    if upload.text:
+        print(upload.text)
+    sys.exit(0 if upload.ok else 1)
+
+
+if __name__ == "__main__":
+    main()
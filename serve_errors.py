@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
-from flask import Flask, jsonify, send_from_directory, Response
+from flask import Flask, jsonify, send_from_directory, Response, request, abort
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import gzip
+import hashlib
+import json
+import logging
 import os
+import threading
+import zlib
 import mimetypes
 
 app = Flask(__name__)
@@ -8,28 +16,223 @@ app = Flask(__name__)
 # Configuration
 TEST_FILES_DIR = "./errors"
 PORT = 8123
+# Connections handled at once, several simulators replaying in parallel each
+# keep a connection or two open
+DEFAULT_THREADS = 16
+# Idle keep-alive connections are closed after this many seconds so they
+# do not hold on to a worker thread
+KEEPALIVE_TIMEOUT = 5
+# Clients may cache error files for this long, they only change between runs
+FILES_MAX_AGE = 60
+# Bodies smaller than this are not worth compressing
+GZIP_MIN_SIZE = 500
+# /bulk.ndjson hands compressed data to the server in pieces of about this size
+BULK_CHUNK_SIZE = 64 * 1024
+# Files written by extract_day_errors.py next to the served cases
+SIDECAR_SUFFIXES = ('manifest.json', '.cases.json')
+
+
+class FileIndex:
+    """In-memory listing of TEST_FILES_DIR, rebuilt when a directory mtime changes.
+
+    Files may sit directly in the directory or in per-function
+    subdirectories, as run_tests_on_errors.py and extract_errors.sh copy
+    them. Only the latter can be filtered by function. Each file's
+    timezone is read once and reused until the file changes.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.dir_mtimes = None
+        self.entries = []
+        self.timezones = {}
+        self.etag = None
+        self.last_modified = None
+
+    def _scan_dir_mtimes(self):
+        mtimes = {}
+        for dirpath, dirnames, _ in os.walk(self.root):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            mtimes[dirpath] = os.stat(dirpath).st_mtime_ns
+        return mtimes
+
+    def _timezone(self, path, st):
+        key = (path, st.st_size, st.st_mtime_ns)
+        if key not in self.timezones:
+            try:
+                with open(path, 'rb') as f:
+                    record = json.load(f)
+                self.timezones[key] = record.get('timezone') if isinstance(record, dict) else None
+            except (OSError, ValueError):
+                self.timezones[key] = None
+        return self.timezones[key]
+
+    def _rebuild(self, dir_mtimes):
+        entries = []
+        timezones = self.timezones
+        self.timezones = {}
+        for dirpath in sorted(dir_mtimes):
+            relative_dir = os.path.relpath(dirpath, self.root)
+            function_name = None if relative_dir == '.' else relative_dir.split(os.sep)[0]
+            for filename in sorted(os.listdir(dirpath)):
+                path = os.path.join(dirpath, filename)
+                if filename.startswith('.') or not os.path.isfile(path):
+                    continue
+                if function_name is None and filename.endswith(SIDECAR_SUFFIXES):
+                    continue
+                st = os.stat(path)
+                key = (path, st.st_size, st.st_mtime_ns)
+                if key in timezones:
+                    self.timezones[key] = timezones[key]
+                name = filename if function_name is None else f"{relative_dir.replace(os.sep, '/')}/{filename}"
+                entries.append({
+                    'name': name,
+                    'path': f"/files/{name}",
+                    'function': function_name,
+                    'timezone': self._timezone(path, st),
+                    'mtime': st.st_mtime,
+                })
+
+        self.entries = entries
+        self.dir_mtimes = dir_mtimes
+        digest = hashlib.blake2b(digest_size=16)
+        for entry in entries:
+            digest.update(f"{entry['path']}\0{entry['mtime']}\n".encode('utf-8'))
+        self.etag = digest.hexdigest()
+        self.last_modified = max([entry['mtime'] for entry in entries] + [mtime / 1e9 for mtime in dir_mtimes.values()], default=0)
+
+    def current(self):
+        """Return (entries, etag, last_modified), rebuilding if the directory changed."""
+        dir_mtimes = self._scan_dir_mtimes()
+        with self.lock:
+            if dir_mtimes != self.dir_mtimes:
+                self._rebuild(dir_mtimes)
+            return self.entries, self.etag, self.last_modified
+
+
+file_index = FileIndex(TEST_FILES_DIR)
+
+
+def _non_negative_int(name):
+    value = request.args.get(name)
+    if value is None:
+        return None
+    if not value.isdigit():
+        abort(400, f"{name} must be a non-negative integer")
+    return int(value)
+
+
+def _filtered(entries):
+    """Apply the function, timezone, offset and limit query parameters.
+
+    Returns (page of entries, number of entries matching the filters).
+    """
+    function_name = request.args.get('function')
+    timezone = request.args.get('timezone')
+    offset = _non_negative_int('offset') or 0
+    limit = _non_negative_int('limit')
+
+    matching = [entry for entry in entries
+                if (function_name is None or entry['function'] == function_name)
+                and (timezone is None or entry['timezone'] == timezone)]
+    page = matching[offset:] if limit is None else matching[offset:offset + limit]
+    return page, len(matching)
+
 
 @app.route('/list')
 def list_files():
-    """Return a JSON array of available files with their metadata"""
+    """Return a JSON array of available files with their metadata
+
+    Optional query parameters: function, timezone, offset and limit. The
+    number of files matching the filters is in the X-Total-Count header.
+    """
+    try:
+        entries, etag, last_modified = file_index.current()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    page, total = _filtered(entries)
+
+    response = jsonify([entry['path'] for entry in page])  # This returns a JSON array directly
+    response.headers['X-Total-Count'] = str(total)
+    # Weak because the body may be gzipped, and varies with the query
+    response.set_etag(hashlib.blake2b(f"{etag}?{request.query_string.decode('latin-1')}".encode('utf-8'), digest_size=16).hexdigest(), weak=True)
+    response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def _bulk_lines(entries):
+    """Yield one NDJSON line per file, reading a single file at a time."""
+    for entry in entries:
+        line = {"filename": entry['name']}
+        try:
+            with open(os.path.join(TEST_FILES_DIR, entry['name']), 'rb') as f:
+                line["record"] = json.load(f)
+        except (OSError, ValueError) as e:
+            line["error"] = str(e)
+        yield (json.dumps(line, separators=(',', ':')) + "\n").encode('utf-8')
+
+
+def _gzip_stream(chunks):
+    """Gzip a stream of byte strings, yielding compressed pieces as they fill up."""
+    compressor = zlib.compressobj(5, zlib.DEFLATED, 31)
+    pending = []
+    pending_size = 0
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            pending.append(compressed)
+            pending_size += len(compressed)
+        if pending_size >= BULK_CHUNK_SIZE:
+            yield b''.join(pending)
+            pending = []
+            pending_size = 0
+    pending.append(compressor.flush())
+    yield b''.join(pending)
+
+
+@app.route('/bulk.ndjson')
+def bulk_files():
+    """Stream the listed files as NDJSON lines of {"filename", "record"}
+
+    Takes the same filters as /list, and is gzipped for clients that accept it.
+    """
     try:
-        files = []
-        for filename in os.listdir(TEST_FILES_DIR):
-            filepath = os.path.join(TEST_FILES_DIR, filename)
-            if os.path.isfile(filepath):
-                files.append(f"/files/{filename}")
-        return jsonify(files)  # This returns a JSON array directly
+        entries, _, _ = file_index.current()
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    page, total = _filtered(entries)
+    body = _bulk_lines(page)
+    headers = {'X-Total-Count': str(total)}
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        body = _gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, mimetype='application/x-ndjson', headers=headers)
+
 @app.route('/files/<path:filename>')
 def serve_file(filename):
     """Serve a specific file by name"""
     try:
-        return send_from_directory(TEST_FILES_DIR, filename)
+        return send_from_directory(TEST_FILES_DIR, filename, max_age=FILES_MAX_AGE)
     except Exception as e:
         return jsonify({"error": f"Error serving file: {str(e)}"}), 500
 
+@app.after_request
+def compress_response(response):
+    """Gzip buffered responses for clients that accept it."""
+    response.vary.add('Accept-Encoding')
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200 or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '')):
+        return response
+    data = response.get_data()
+    if len(data) < GZIP_MIN_SIZE:
+        return response
+    response.set_data(gzip.compress(data, compresslevel=5))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
 @app.route('/')
 def index():
     """Serve a simple help page"""
@@ -40,19 +243,149 @@ def index():
         <h1>Test File Server</h1>
         <p>Available endpoints:</p>
         <ul>
-            <li><a href="/list">/list</a> - Get JSON array of available files</li>
+            <li><a href="/list">/list</a> - Get JSON array of available files, optionally filtered with
+                ?function=, ?timezone= and paged with ?offset= and ?limit=</li>
             <li>/files/FILENAME - Download a specific file</li>
+            <li><a href="/bulk.ndjson">/bulk.ndjson</a> - Stream every listed file as one NDJSON line of
+                {"filename", "record"}, with the same filters as /list</li>
         </ul>
     </body>
     </html>
     """
 
-if __name__ == "__main__":
+def run_gunicorn(host, port, threads, workers, access_log=False):
+    """Serve with gunicorn's threaded workers."""
+    from gunicorn.app.base import BaseApplication
+
+    class ErrorsApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', workers)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', threads)
+            self.cfg.set('keepalive', KEEPALIVE_TIMEOUT)
+            self.cfg.set('sendfile', True)
+            if access_log:
+                self.cfg.set('accesslog', '-')
+
+        def load(self):
+            return app
+
+    ErrorsApplication().run()
+
+
+def make_pooled_server(host, port, threads):
+    """A werkzeug server handling keep-alive connections on a fixed thread pool.
+
+    /files bodies are sent with sendfile, like gunicorn does.
+    """
+    from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+    from werkzeug.wsgi import FileWrapper
+
+    class SendfileWrapper(FileWrapper):
+        """wsgi.file_wrapper sending the file with socket.sendfile."""
+
+        def __init__(self, connection, file, buffer_size=8192):
+            super().__init__(file, buffer_size)
+            self.connection = connection
+            self.use_sendfile = True
+            self.headers_written = False
+
+        def seek(self, *args):
+            # Range responses seek and then read a part of the file
+            self.use_sendfile = False
+            super().seek(*args)
+
+        def __next__(self):
+            if self.use_sendfile:
+                # werkzeug writes the headers with the first chunk, even an empty one
+                if not self.headers_written:
+                    self.headers_written = True
+                    return b''
+                self.use_sendfile = False
+                self.connection.sendfile(self.file)
+            return super().__next__()
+
+    class KeepAliveRequestHandler(WSGIRequestHandler):
+        protocol_version = "HTTP/1.1"
+        timeout = KEEPALIVE_TIMEOUT
+
+        def make_environ(self):
+            environ = super().make_environ()
+            environ['wsgi.file_wrapper'] = lambda file, buffer_size=8192: SendfileWrapper(self.connection, file, buffer_size)
+            return environ
+
+    class PooledWSGIServer(BaseWSGIServer):
+        request_queue_size = 128
+
+        def __init__(self):
+            super().__init__(host, port, app, handler=KeepAliveRequestHandler)
+            self.executor = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self._process_request, request, client_address)
+
+        def _process_request(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+        def server_close(self):
+            super().server_close()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    return PooledWSGIServer()
+
+
+def main():
+    global TEST_FILES_DIR, file_index
+
+    parser = argparse.ArgumentParser(description="Serve extracted error files to the Swift replay tests.")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--dir', default=TEST_FILES_DIR, help="Directory of error files to serve")
+    parser.add_argument('--threads', type=int, default=DEFAULT_THREADS, help="Connections handled concurrently per process")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes, gunicorn only")
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'werkzeug'], default='auto',
+                        help="auto uses gunicorn when it is installed, werkzeug otherwise")
+    parser.add_argument('--debug', action='store_true', help="Run Flask's single-process debug server with the reloader")
+    parser.add_argument('--access-log', action='store_true', help="Log every request")
+    args = parser.parse_args()
+
+    TEST_FILES_DIR = args.dir
+    file_index = FileIndex(TEST_FILES_DIR)
+
     # Create test files directory if it doesn't exist
     os.makedirs(TEST_FILES_DIR, exist_ok=True)
-    
-    print(f"Starting Flask test file server on port {PORT}...")
+
+    print(f"Starting Flask test file server on port {args.port}...")
     print(f"Test files directory: {os.path.abspath(TEST_FILES_DIR)}")
-    print(f"Server URL: http://localhost:{PORT}")
-    
-    app.run(host='0.0.0.0', port=PORT, debug=True)
+    print(f"Server URL: http://localhost:{args.port}")
+
+    if args.debug:
+        app.run(host=args.host, port=args.port, debug=True)
+        return
+
+    server = args.server
+    if server == 'auto':
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn'
+        except ImportError:
+            server = 'werkzeug'
+
+    if server == 'gunicorn':
+        print(f"Serving with gunicorn, {args.workers} worker(s) x {args.threads} threads")
+        run_gunicorn(args.host, args.port, args.threads, args.workers, args.access_log)
+    else:
+        print(f"Serving with werkzeug, {args.threads} threads")
+        if not args.access_log:
+            logging.getLogger('werkzeug').setLevel(logging.WARNING)
+        make_pooled_server(args.host, args.port, args.threads).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Tests for scripts/error_cases.py.
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from error_cases import CaseIndex, case_hash  # noqa: E402
+
+
+def record(created_at, device_id, dose_age=300, amount=1.0):
+    """An iob error reported at `created_at`, with one dose `dose_age` seconds before the input's clock."""
+    clock = 1750000000
+    return {
+        "resultType": "valueDifference",
+        "createdAt": created_at,
+        "deviceId": device_id,
+        "jsDuration": 5.0,
+        "swiftDuration": 7.0,
+        "timezone": "Europe/Berlin",
+        "iobInput": {
+            "clock": clock,
+            "history": [{"amount": amount, "createdAt": clock - dose_age}],
+        },
+    }
+
+
+class CaseHashTest(unittest.TestCase):
+    def test_report_fields_are_ignored(self):
+        first = record(1750000000, "DEV-A")
+        second = record(1750000600, "DEV-B")
+        self.assertEqual(case_hash(first), case_hash(second))
+
+        cases = CaseIndex()
+        cases.add(first, "DEV-A", "0.6.0", "a.json[0]")
+        cases.add(second, "DEV-B", "0.6.0", "b.json[0]")
+        self.assertEqual(len(cases), 1)
+        self.assertEqual(cases.occurrences(), 2)
+
+    def test_history_timing_makes_different_cases(self):
+        recent = record(1750000000, "DEV-A", dose_age=300)
+        older = record(1750000000, "DEV-A", dose_age=7200)
+        self.assertNotEqual(case_hash(recent), case_hash(older))
+
+        cases = CaseIndex()
+        cases.add(recent, "DEV-A", "0.6.0", "a.json[0]")
+        cases.add(older, "DEV-A", "0.6.0", "a.json[1]")
+        self.assertEqual(len(cases), 2)
+
+    def test_different_inputs_are_different_cases(self):
+        self.assertNotEqual(case_hash(record(1750000000, "DEV-A")), case_hash(record(1750000000, "DEV-A", amount=2.0)))
+
+    def test_records_without_inputs(self):
+        first = {"resultType": "valueDifference", "createdAt": 1, "glucose": [{"value": 100}]}
+        second = {"resultType": "jsError", "createdAt": 2, "glucose": [{"value": 100}]}
+        self.assertEqual(case_hash(first), case_hash(second))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+"""Tests for scripts/ingest_worker.py against a local directory bucket.
+
+    python -m pytest tests
+"""
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from ingest_worker import PREFIX, DirectoryBucket, IngestWorker, load_local_downloader  # noqa: E402
+from pack_comparisons import pack  # noqa: E402
+
+LocalDownloader = load_local_downloader()
+
+
+def day(days_ago):
+    return (datetime.now(timezone.utc) - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+
+
+def record(result_type, x=0):
+    return {
+        "resultType": result_type,
+        "createdAt": 1750000000,
+        "iobInput": {"x": x},
+        "jsDuration": 5.0,
+        "swiftDuration": 7.0,
+    }
+
+
+class IngestWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.source_dir = os.path.join(self.tmp.name, 'bucket')
+        self.output_dir = os.path.join(self.tmp.name, 'downloaded_files')
+
+    def upload(self, date, name, records, function='iob', device_id='DEV-A'):
+        path = os.path.join(self.source_dir, *PREFIX.split('/'), date, '0.6.0', function, device_id, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(records, f)
+
+    def worker(self):
+        downloader = LocalDownloader(bucket=DirectoryBucket(self.source_dir), output_dir=self.output_dir)
+        return IngestWorker(downloader, lookback_days=1)
+
+    def test_restart_counts_every_batch_once(self):
+        self.upload(day(0), 'a.json', [record('matching'), record('valueDifference')])
+        self.upload(day(1), 'b.json', [record('valueDifference', x=1)], function='meal')
+
+        worker = self.worker()
+        self.assertEqual(worker.poll(), 2)
+        self.assertEqual(worker.state.stats['total_comparisons'], 3)
+        self.assertEqual(worker.state.stats['total_errors'], 2)
+
+        # A restarted worker resumes from the saved state
+        worker = self.worker()
+        self.assertEqual(worker.poll(), 0)
+        self.upload(day(0), 'c.json', [record('valueDifference')])
+        self.assertEqual(worker.poll(), 1)
+        self.assertEqual(worker.state.stats['total_errors'], 3)
+        # The same error again is no new case
+        self.assertEqual(len(worker.state.cases['iob']), 1)
+
+        with open(os.path.join(self.output_dir, 'ingest_summary.json')) as f:
+            summary = json.load(f)
+        self.assertEqual(summary['batches'], 3)
+        self.assertEqual(summary['errors_by_function'], {'iob': 2, 'meal': 1})
+
+    def test_crash_before_commit_ingests_again(self):
+        self.upload(day(0), 'a.json', [record('valueDifference')])
+        worker = self.worker()
+        for blob in worker.downloader.bucket.list_blobs(prefix=PREFIX):
+            self.assertTrue(worker.ingest(blob))
+        # Stopped without commit(), so nothing counted yet
+        worker = self.worker()
+        self.assertEqual(worker.poll(), 1)
+        self.assertEqual(worker.state.stats['total_errors'], 1)
+
+    def test_reads_packed_batches(self):
+        self.upload(day(1), 'a.json', [record('valueDifference'), record('matching')])
+        worker = self.worker()
+        for blob in worker.downloader.bucket.list_blobs(prefix=PREFIX):
+            worker.ingest(blob)
+        # Downloaded but not committed, then the day is packed
+        pack([day(1)], base_dir=worker.base_dir, packed_dir=worker.packed_dir)
+        self.assertFalse(os.path.exists(os.path.join(worker.base_dir, day(1), '0.6.0', 'iob', 'DEV-A', 'a.json')))
+
+        worker = self.worker()
+        self.assertEqual(worker.poll(), 1)
+        self.assertEqual(worker.state.stats['total_comparisons'], 2)
+        self.assertEqual(worker.state.stats['total_errors'], 1)
+
+    def test_late_uploads_of_old_days_are_ingested(self):
+        # Created five days ago on a phone that was offline, uploaded now
+        self.upload(day(5), 'late.json', [record('valueDifference')])
+        worker = self.worker()
+        self.assertEqual(worker.poll(), 0)
+        self.assertEqual(worker.poll(rescan=True), 1)
+        self.assertEqual(worker.state.stats['errors_by_day'], {day(5): 1})
+
+    def test_skips_and_prunes_batches_uploaded_before_the_window(self):
+        self.upload(day(0), 'old.json', [record('valueDifference')])
+        self.upload(day(0), 'a.json', [record('valueDifference')])
+        old_path = os.path.join(self.source_dir, *PREFIX.split('/'), day(0), '0.6.0', 'iob', 'DEV-A', 'old.json')
+        uploaded = (datetime.now(timezone.utc) - timedelta(days=8)).timestamp()
+        os.utime(old_path, (uploaded, uploaded))
+
+        worker = self.worker()
+        pruned_name = f"{PREFIX}{day(0)}/0.6.0/iob/DEV-A/pruned.json"
+        worker.state.processed[pruned_name] = (datetime.now(timezone.utc) - timedelta(days=8)).isoformat()
+        self.assertEqual(worker.poll(), 1)
+        self.assertEqual(list(worker.state.processed), [f"{PREFIX}{day(0)}/0.6.0/iob/DEV-A/a.json"])
+        self.assertEqual(worker.state.stats['total_errors'], 1)
+
+        with open(os.path.join(self.output_dir, 'ingest_summary.json')) as f:
+            self.assertEqual(json.load(f)['skipped_too_old'], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
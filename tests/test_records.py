@@ -0,0 +1,41 @@
+"""Tests for scripts/records.py.
+
+    python -m pytest tests
+"""
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+
+from records import iter_records  # noqa: E402
+
+RECORDS = [{"a": 1}, {"b": 123456789012345678901234567890}, {"c": 2.5}]
+
+
+class IterRecordsTest(unittest.TestCase):
+    def write(self, name, data):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = os.path.join(tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_integers_beyond_64_bits(self):
+        data = json.dumps(RECORDS).encode('utf-8')
+        for path in (self.write('a.json', data), self.write('a.json.gz', gzip.compress(data))):
+            self.assertEqual(list(iter_records(path)), RECORDS)
+
+    def test_corrupt_file_raises(self):
+        path = self.write('a.json', json.dumps(RECORDS).encode('utf-8')[:-5] + b'xx]')
+        with self.assertRaises(json.JSONDecodeError):
+            list(iter_records(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
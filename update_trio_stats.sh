@@ -1,4 +1,5 @@
 #!/bin/bash
 python scripts/local-downloader.py
+python scripts/comparison_index.py update
 python scripts/calculate_stats.py
 